@@ -1,15 +1,17 @@
 """An API server for covid-19-ui."""
 import json
 from datetime import datetime
+from typing import Optional
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from mojimoji import han_to_zen
 
-from db_handler import DBHandler
+from cache_handler import CacheHandler
+from db_handler import DBHandler, InvalidCursor
 from log_handler import LogHandler
 from meta_data_handler import MetaDataHandler
-from slack_handler import SlackHandler
+from slack_handler import SlackHandler, SlackQueue
 from util import load_config
 
 
@@ -47,12 +49,18 @@ class InvalidPassword(Exception):
         return rv
 
 
+MAX_HISTORY_BATCH_SIZE = 1000
+
 cfg = load_config()
 
 meta_data_handler = MetaDataHandler()
-db_handler = DBHandler(**cfg["db_handler"])
+cache_handler = CacheHandler(**cfg["cache_handler"])
+db_handler = DBHandler(**cfg["db_handler"], cache_handler=cache_handler)
 log_handler = LogHandler(**cfg["log_handler"])
+log_handler.update_topic_check_index()  # NOTE: build the index if it is missing.
 slack_handlers = [SlackHandler(**args) for args in cfg["slack_handlers"]]
+slack_queue = SlackQueue(slack_handlers, **cfg["slack_queue"])
+slack_queue.start()  # NOTE: deliver the messages left by the last run.
 
 app = Flask(__name__)
 CORS(app, **cfg["cors"])
@@ -92,12 +100,28 @@ def get_query() -> str:
     return request.args.get("query", "")
 
 
+def get_cursor() -> Optional[str]:
+    cursor = request.args.get("cursor")
+    if cursor is None:
+        return None
+    try:
+        DBHandler.decode_cursor(cursor)
+    except InvalidCursor:
+        raise InvalidUsage('Parameter "cursor" is invalid.')
+    return cursor
+
+
 @app.route("/articles/topic")
 @app.route("/articles/topic/<topic>")
 @app.route("/articles/topic/<topic>/<country>")
 def articles_sorted_by_topic(topic=None, country=None):
-    ret = db_handler.get_articles_sorted_by_topic(
-        topic, country, get_start(), get_limit(), get_lang(), get_query()
+    start, limit, lang, query, cursor = get_start(), get_limit(), get_lang(), get_query(), get_cursor()
+    ret = cache_handler.get_or_set(
+        ("articles_sorted_by_topic", topic, country, start, limit, lang, query, cursor),
+        lambda: db_handler.get_articles_sorted_by_topic(
+            topic, country, start, limit, lang, query, cursor
+        ),
+        is_partial=db_handler.pop_is_partial,
     )
     return jsonify(ret)
 
@@ -106,8 +130,13 @@ def articles_sorted_by_topic(topic=None, country=None):
 @app.route("/articles/country/<country>")
 @app.route("/articles/country/<country>/<topic>")
 def articles_sorted_by_country(country=None, topic=None):
-    ret = db_handler.get_articles_sorted_by_country(
-        country, topic, get_start(), get_limit(), get_lang(), get_query()
+    start, limit, lang, query, cursor = get_start(), get_limit(), get_lang(), get_query(), get_cursor()
+    ret = cache_handler.get_or_set(
+        ("articles_sorted_by_country", topic, country, start, limit, lang, query, cursor),
+        lambda: db_handler.get_articles_sorted_by_country(
+            country, topic, start, limit, lang, query, cursor
+        ),
+        is_partial=db_handler.pop_is_partial,
     )
     return jsonify(ret)
 
@@ -116,7 +145,11 @@ def articles_sorted_by_country(country=None, topic=None):
 @app.route("/positive_articles/country/<country>")
 @app.route("/positive_articles/topic/<topic>")
 def positive_articles(topic=None, country=None):
-    ret = db_handler.get_positive_articles(topic, country, get_lang(), get_query())
+    lang, query = get_lang(), get_query()
+    ret = cache_handler.get_or_set(
+        ("positive_articles", topic, country, None, None, lang, query, None),
+        lambda: db_handler.get_positive_articles(topic, country, lang, query),
+    )
     return jsonify(ret)
 
 
@@ -124,8 +157,13 @@ def positive_articles(topic=None, country=None):
 @app.route("/tweets/topic/<topic>")
 @app.route("/tweets/topic/<topic>/<country>")
 def tweets_sorted_by_topic(topic=None, country=None):
-    ret = db_handler.get_tweets_sorted_by_topic(
-        topic, country, get_start(), get_limit(), get_lang(), get_query()
+    start, limit, lang, query, cursor = get_start(), get_limit(), get_lang(), get_query(), get_cursor()
+    ret = cache_handler.get_or_set(
+        ("tweets_sorted_by_topic", topic, country, start, limit, lang, query, cursor),
+        lambda: db_handler.get_tweets_sorted_by_topic(
+            topic, country, start, limit, lang, query, cursor
+        ),
+        is_partial=db_handler.pop_is_partial,
     )
     return jsonify(ret)
 
@@ -134,8 +172,13 @@ def tweets_sorted_by_topic(topic=None, country=None):
 @app.route("/tweets/country/<country>")
 @app.route("/tweets/country/<country>/<topic>")
 def tweets_sorted_by_country(country=None, topic=None):
-    ret = db_handler.get_tweets_sorted_by_country(
-        country, topic, get_start(), get_limit(), get_lang(), get_query()
+    start, limit, lang, query, cursor = get_start(), get_limit(), get_lang(), get_query(), get_cursor()
+    ret = cache_handler.get_or_set(
+        ("tweets_sorted_by_country", topic, country, start, limit, lang, query, cursor),
+        lambda: db_handler.get_tweets_sorted_by_country(
+            country, topic, start, limit, lang, query, cursor
+        ),
+        is_partial=db_handler.pop_is_partial,
     )
     return jsonify(ret)
 
@@ -169,6 +212,17 @@ def history():
     return jsonify(log_handler.find_topic_check_log(url=request.args.get("url")))
 
 
+@app.route("/history/batch", methods=["POST"])
+def history_batch():
+    data = request.get_json()
+    urls = data.get("urls") if isinstance(data, dict) else None
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        raise InvalidUsage('Parameter "urls" must be a list of strings.')
+    if len(urls) > MAX_HISTORY_BATCH_SIZE:
+        raise InvalidUsage(f'Parameter "urls" must contain at most {MAX_HISTORY_BATCH_SIZE} URLs.')
+    return jsonify(log_handler.find_topic_check_logs(urls))
+
+
 @app.route("/feedback", methods=["POST"])
 def feedback():
     data = request.get_json()
@@ -178,17 +232,23 @@ def feedback():
     if len(feedback_content) > 1000:
         raise InvalidUsage("Feedback content is too long.")
 
-    for slack_handler in slack_handlers:
-        slack_handler.post(feedback_content)
+    # NOTE: messages are posted to Slack by a background thread, so the response does not wait for Slack.
+    slack_queue.put(feedback_content)
 
     log_handler.extend_feedback_log([f"{datetime.today()}\t{feedback_content}"])
 
     return jsonify({})
 
 
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify(cache_handler.get_stats())
+
+
 @app.route("/meta")
 def meta():
-    return jsonify(meta_data_handler.get(get_lang()))
+    # NOTE: the payload is served as it was serialized, which takes no more than a few stats of the files.
+    return app.response_class(meta_data_handler.get_json(get_lang()), mimetype="application/json")
 
 
 @app.errorhandler(InvalidUsage)
@@ -198,6 +258,12 @@ def handle_invalid_usage(error):
     return response
 
 
+@app.errorhandler(InvalidCursor)
+def handle_invalid_cursor(error):
+    # NOTE: a cursor issued for another route does not match the sort order of this one.
+    return handle_invalid_usage(InvalidUsage('Parameter "cursor" is invalid.'))
+
+
 @app.errorhandler(InvalidPassword)
 def handle_invalid_password(error):
     response = jsonify(error.to_dict())
@@ -0,0 +1,233 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from sqlite_handler import SQLiteHandler
+
+logger = logging.getLogger(__file__)
+
+# The access time of an entry is updated at most once in this many seconds, so that most hits only read the cache.
+ACCESS_TIME_RESOLUTION = 60.0
+
+
+class MemoryCacheBackend:
+    """A per-process cache backend. Use it as a stand-in for the shared backend in tests and development."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.entries: "OrderedDict[str, Tuple[int, float, str]]" = OrderedDict()
+
+    def get_version(self) -> int:
+        return self.version
+
+    def bump_version(self) -> int:
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
+            return self.version
+
+    def get(self, key: str, version: int, now: float) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            entry_version, expires_at, value = entry
+            if entry_version != version or expires_at <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, version: int, expires_at: float, value: str, max_entries: int) -> None:
+        with self.lock:
+            if version != self.version:
+                return  # NOTE: the value may have been built from the data before the version was bumped.
+            self.entries[key] = (version, expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+
+    def count(self) -> int:
+        return len(self.entries)
+
+
+class SQLiteCacheBackend:
+    """A cache backend stored in an SQLite file, which is shared by all the processes that open the same path."""
+
+    def __init__(self, path: str, timeout: float = 1.0):
+        if not path:
+            # NOTE: SQLite opens a private temporary database for an empty path, which no other thread would see.
+            raise ValueError("The path of the cache is empty.")
+        self.path = path
+        self.sqlite_handler = SQLiteHandler(path, timeout=timeout, statements=["PRAGMA synchronous=NORMAL"])
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('version', 0)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, version INTEGER, expires_at REAL, accessed_at REAL, value TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    def connect(self) -> sqlite3.Connection:
+        return self.sqlite_handler.connect()
+
+    def get_version(self) -> int:
+        row = self.connect().execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        return row[0]
+
+    def bump_version(self) -> int:
+        with self.connect() as conn:
+            conn.execute("UPDATE meta SET value = value + 1 WHERE name = 'version'")
+            version = conn.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()[0]
+            conn.execute("DELETE FROM entries WHERE version < ?", (version,))
+        return version
+
+    def get(self, key: str, version: int, now: float) -> Optional[str]:
+        conn = self.connect()
+        row = conn.execute(
+            "SELECT value, accessed_at FROM entries WHERE key = ? AND version = ? AND expires_at > ?",
+            (key, version, now),
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[1] >= ACCESS_TIME_RESOLUTION:
+            # NOTE: the order of eviction only needs to be roughly LRU, so hits rarely take the write lock.
+            with conn:
+                conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, version: int, expires_at: float, value: str, max_entries: int) -> None:
+        with self.connect() as conn:
+            # NOTE: the value may have been built from the data before the version was bumped, so it is stored only
+            # if the version is still the one read before building it. The check and the write are atomic.
+            cur = conn.execute(
+                "INSERT OR REPLACE INTO entries SELECT ?, ?, ?, ?, ? FROM meta WHERE name = 'version' AND value = ?",
+                (key, version, expires_at, time.time(), value, version),
+            )
+            if cur.rowcount == 0:
+                return
+            overflow = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed_at LIMIT ?)",
+                    (overflow,),
+                )
+
+    def count(self) -> int:
+        return self.connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+class CacheHandler:
+    """A response cache invalidated by a data version.
+
+    Entries are evicted in LRU order when there are more than `max_entries`, and expire after `ttl` seconds.
+    A partial response, some of whose queries failed, expires after `partial_ttl` seconds instead.
+    Bumping the data version makes all the existing entries stale at once.
+    """
+
+    def __init__(
+        self,
+        backend: str = "sqlite",
+        path: str = "",
+        max_entries: int = 10000,
+        ttl: float = 3600.0,
+        partial_ttl: float = 10.0,
+    ):
+        if backend == "sqlite":
+            self.backend = SQLiteCacheBackend(path)
+        elif backend == "memory":
+            self.backend = MemoryCacheBackend()
+        else:
+            raise ValueError(f"Unknown cache backend: {backend}")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.partial_ttl = partial_ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(key: Tuple[Hashable, ...]) -> str:
+        return json.dumps(key, ensure_ascii=False)
+
+    def get(self, key: Tuple[Hashable, ...], version: Optional[int] = None) -> Optional[Any]:
+        try:
+            if version is None:
+                version = self.backend.get_version()
+            value = self.backend.get(self.make_key(key), version, time.time())
+        except sqlite3.Error as e:
+            logger.warning(f"Error when reading the cache: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(
+        self, key: Tuple[Hashable, ...], value: Any, ttl: Optional[float] = None, version: Optional[int] = None
+    ) -> None:
+        """Cache a value. With `version`, the value is not cached if the version has been bumped since then."""
+        try:
+            if version is None:
+                version = self.backend.get_version()
+            self.backend.set(
+                self.make_key(key),
+                version,
+                time.time() + (self.ttl if ttl is None else ttl),
+                json.dumps(value, ensure_ascii=False),
+                self.max_entries,
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Error when writing the cache: {e}")
+
+    def get_or_set(
+        self, key: Tuple[Hashable, ...], func: Callable[[], Any], is_partial: Optional[Callable[[], bool]] = None
+    ) -> Any:
+        """Return the cached value of `key`, or call `func` and cache its value.
+
+        `is_partial` is called right after `func` to tell if the value is partial, which is cached briefly.
+        """
+        # NOTE: read the version before building the value, so that a value built while the data is being updated
+        # is not cached under the new version.
+        try:
+            version = self.backend.get_version()
+        except sqlite3.Error as e:
+            logger.warning(f"Error when reading the cache: {e}")
+            return func()
+        value = self.get(key, version)
+        if value is None:
+            value = func()
+            ttl = self.partial_ttl if is_partial is not None and is_partial() else None
+            self.set(key, value, ttl=ttl, version=version)
+        return value
+
+    def bump_version(self) -> Optional[int]:
+        """Make all the cached responses stale. Call this whenever the underlying data changes.
+
+        Return the new version, or None if the cache could not be updated, in which case the responses cached
+        before expire after the TTL.
+        """
+        try:
+            return self.backend.bump_version()
+        except sqlite3.Error as e:
+            logger.error(f"Error when bumping the version of the cache: {e}")
+            return None
+
+    def get_stats(self) -> Dict[str, Optional[int]]:
+        try:
+            version, entries = self.backend.get_version(), self.backend.count()
+        except sqlite3.Error as e:
+            logger.warning(f"Error when reading the cache: {e}")
+            version, entries = None, None
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "version": version,
+            "entries": entries,
+        }
@@ -0,0 +1,40 @@
+import json
+import os
+import tempfile
+
+
+class CheckpointHandler:
+    """Store the progress of incremental jobs as JSON files, each of which is replaced atomically."""
+
+    def __init__(self, checkpoint_dir: str):
+        self.checkpoint_dir = checkpoint_dir
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(self.checkpoint_dir, f"{name}.json")
+
+    def load(self, name: str) -> dict:
+        try:
+            with open(self.get_path(name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, name: str, checkpoint: dict) -> None:
+        # Write a temporary file in the same directory and rename it so that a crash never leaves a partial file.
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.checkpoint_dir, prefix=f".{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(checkpoint, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.get_path(name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def remove(self, name: str) -> None:
+        try:
+            os.remove(self.get_path(name))
+        except FileNotFoundError:
+            pass
@@ -12,6 +12,7 @@ config = {
     "password": os.getenv("PASSWORD"),
     "log_handler": {
         "log_dir": os.getenv("LOG_HANDLER_LOG_DIR"),
+        "max_bytes": int(os.getenv("LOG_HANDLER_MAX_BYTES", "104857600")),
     },
     "cors": {
         "origins": os.getenv("CORS_ORIGINS"),
@@ -28,6 +29,22 @@ config = {
         ),
         "es_host": os.getenv("DB_HANDLER_ES_HOST"),
         "es_port": int(os.getenv("DB_HANDLER_ES_PORT")),
+        "max_workers": int(os.getenv("DB_HANDLER_MAX_WORKERS", "8")),
+        "fan_out_timeout": float(os.getenv("DB_HANDLER_FAN_OUT_TIMEOUT", "10")),
+        "check_indexes": os.getenv("DB_HANDLER_CHECK_INDEXES", "1") == "1",
+        "mongo_feed_collection_name": os.getenv(
+            "DB_HANDLER_MONGO_FEED_COLLECTION_NAME", "feeds"
+        ),
+        "feed_size": int(os.getenv("DB_HANDLER_FEED_SIZE", "100")),
+    },
+    "cache_handler": {
+        "backend": os.getenv("CACHE_HANDLER_BACKEND", "sqlite"),
+        # NOTE: the variable may be set but empty, in which case the default is used.
+        "path": os.getenv("CACHE_HANDLER_PATH")
+        or os.path.join(os.getenv("LOG_HANDLER_LOG_DIR", ""), "cache.sqlite3"),
+        "max_entries": int(os.getenv("CACHE_HANDLER_MAX_ENTRIES", "10000")),
+        "ttl": float(os.getenv("CACHE_HANDLER_TTL", "3600")),
+        "partial_ttl": float(os.getenv("CACHE_HANDLER_PARTIAL_TTL", "10")),
     },
     "twitter_handler": {
         "token": os.getenv("TWITTER_HANDLER_OAUTH_TOKEN"),
@@ -36,12 +53,24 @@ config = {
         "consumer_secret": os.getenv("TWITTER_HANDLER_OAUTH_CONSUMER_SECRET"),
     },
     "slack_handlers": [
-        {"access_token": access_token, "app_channel": app_channel}
+        {
+            "access_token": access_token,
+            "app_channel": app_channel,
+            "timeout": float(os.getenv("SLACK_HANDLER_TIMEOUT", "10")),
+        }
         for access_token, app_channel in zip(
             os.getenv("SLACK_HANDLER_ACCESS_TOKENS").split(),
             os.getenv("SLACK_HANDLER_APP_CHANNELS").split(),
         )
     ],
+    "slack_queue": {
+        # NOTE: the variable may be set but empty, in which case the default is used.
+        "path": os.getenv("SLACK_QUEUE_PATH")
+        or os.path.join(os.getenv("LOG_HANDLER_LOG_DIR", ""), "slack_queue.sqlite3"),
+        "batch_size": int(os.getenv("SLACK_QUEUE_BATCH_SIZE", "20")),
+        "batch_window": float(os.getenv("SLACK_QUEUE_BATCH_WINDOW", "1")),
+        "max_attempts": int(os.getenv("SLACK_QUEUE_MAX_ATTEMPTS", "10")),
+    },
     "data": {
         "article_list": os.getenv("ARTICLE_LIST"),
         "tweet_list": os.getenv("TWEET_LIST"),
@@ -1,22 +1,34 @@
 import argparse
 import collections
+import gzip
+import io
+import itertools
 import json
 import logging
+import multiprocessing
+import multiprocessing.pool
 import os
 import pathlib
+import queue
 import random
 import shutil
+import signal
 import tempfile
+import threading
 import time
 import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict
+from functools import partial
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, List, Dict, Optional, Tuple
 
-from langdetect import detect
 import pandas as pd
 
+from cache_handler import CacheHandler
+from checkpoint_handler import CheckpointHandler
 from db_handler import DBHandler, Status, Tweet
+from lang_checker import LanguageChecker
 from log_handler import LogHandler
 from meta_data_handler import MetaDataHandler
 from twitter_handler import TwitterHandler
@@ -36,190 +48,384 @@ logger = logging.getLogger(__file__)
 cfg = load_config()
 
 meta_data_handler = MetaDataHandler()
-db_handler = DBHandler(**cfg["db_handler"])
+cache_handler = CacheHandler(**cfg["cache_handler"])
+db_handler = DBHandler(**cfg["db_handler"], cache_handler=cache_handler)
 log_handler = LogHandler(**cfg["log_handler"])
 twitter_handler = TwitterHandler(**cfg["twitter_handler"])
-
-
-def update_database(do_tweet: bool = False):
-    logger.debug("Add automatically categorized pages.")
-    data_path = cfg["data"]["article_list"]
-    cache_file = f'{cfg["log_handler"]["log_dir"]}/offset.txt'
-    if os.path.exists(cache_file):
-        with open(cache_file) as f:
-            offset = int(f.read().strip())
-    else:
+checkpoint_handler = CheckpointHandler(cfg["log_handler"]["log_dir"])
+language_checker = LanguageChecker(os.path.join(cfg["log_handler"]["log_dir"], "lang_cache.sqlite3"))
+
+ARTICLE_LIST_CHECKPOINT = "article_list"
+MANUAL_CHECK_CHECKPOINT = "manual_checks"
+TWEET_MANIFEST_CHECKPOINT = "tweet_manifest"
+TWEET_BATCH_SIZE = 1000
+ARTICLE_BATCH_SIZE = 1000
+ARTICLE_CHUNK_SIZE = 100  # the number of lines sent to a worker process at once
+ARTICLE_SHARD_SUFFIXES = (".jsonl", ".jsonl.gz", ".jsonl.zst")
+
+
+def get_article_list_shards(data_path: str) -> List[Tuple[str, str]]:
+    """Return the (name, path) pairs of the files of the article list, which is either a file or a directory."""
+    if not os.path.isdir(data_path):
+        return [(os.path.basename(data_path), data_path)]
+    shards = []
+    for dir_path, _, file_names in os.walk(data_path):
+        for file_name in file_names:
+            if file_name.endswith(ARTICLE_SHARD_SUFFIXES):
+                path = os.path.join(dir_path, file_name)
+                shards.append((os.path.relpath(path, data_path), path))
+    return sorted(shards)
+
+
+def load_article_list_checkpoints(data_path: str) -> Dict[str, dict]:
+    """Load the checkpoint of each file of the article list. Checkpoints of removed files are dropped."""
+    checkpoint = checkpoint_handler.load(ARTICLE_LIST_CHECKPOINT)
+    legacy_cache_file = f'{cfg["log_handler"]["log_dir"]}/offset.txt'
+    if not checkpoint and os.path.exists(legacy_cache_file) and os.path.isfile(data_path):
+        # Convert the number of lines written by older versions into a byte offset.
+        with open(legacy_cache_file) as f:
+            num_lines = int(f.read().strip())
         offset = 0
-    logger.debug(f"Skip the first {offset} lines.")
-    maybe_tweeted_ds = []
-    with open(data_path, mode="r", encoding="utf-8", errors="ignore") as f:
-        for line_idx, line in enumerate(f):
-            if line_idx < offset:
-                continue
-            try:
-                d = json.loads(line)
-            except json.decoder.JSONDecodeError:
-                continue
-
-            if (
-                not d["orig"]["title"]
-                or not d["ja_translated"]["title"]
-                or not d["en_translated"]["title"]
-            ):
-                continue
-
-            try:
-                if detect(d["ja_translated"]["title"]) != "ja":
-                    logger.warning(
-                        f'Skip {d["url"]}: Japanese title is not in Japanese.'
-                    )
-                    continue
-                if detect(d["en_translated"]["title"]) != "en":
-                    logger.warning(f'Skip {d["url"]}: English title is not in English.')
-                    continue
-            except Exception as e:
-                logger.warning(f"Error when detecting the language: {e}")
-                continue
-
-            def reshape_snippets(snippets: Dict[str, List[str]]) -> Dict[str, str]:
-                # Find a general snippet.
-                general_snippet = ""
-                for itopic in ITOPICS:
-                    if itopic in snippets:
-                        general_snippet = (
-                            snippets[itopic][0] if snippets[itopic] else ""
-                        )
-                        break
-
-                # Reshape snippets.
-                reshaped = {}
-                for itopic in ITOPICS:
-                    snippets_about_topic = snippets.get(itopic, [])
-                    if snippets_about_topic and snippets_about_topic[0]:
-                        reshaped[itopic] = snippets_about_topic[0].strip()
-                    else:
-                        reshaped[itopic] = general_snippet
-                return reshaped
-
-            is_about_covid_19: int = d["classes"]["is_about_COVID-19"]
-            country: str = d["country"]
-            orig: Dict[str, str] = {
-                "title": d["orig"]["title"].strip(),
-                "timestamp": d["orig"]["timestamp"],
-                "simple_timestamp": datetime.fromisoformat(d["orig"]["timestamp"])
-                .date()
-                .isoformat(),
-            }
-            ja_translated: Dict[str, str] = {
-                "title": d["ja_translated"]["title"].strip(),
-                "timestamp": d["ja_translated"]["timestamp"],
-            }
-            en_translated: Dict[str, str] = {
-                "title": d["en_translated"]["title"].strip(),
-                "timestamp": d["en_translated"]["timestamp"],
-            }
-            url: str = d["url"]
-            topics_to_score: Dict[str, float] = {
-                key: value
-                for key, value in d["classes_bert"].items()
-                if key in ITOPICS and value > 0.5
+        with open(data_path, mode="rb") as f:
+            for _ in range(num_lines):
+                offset += len(f.readline())
+        checkpoint = {"shards": {os.path.basename(data_path): {"inode": os.stat(data_path).st_ino, "offset": offset}}}
+    checkpoints = checkpoint.get("shards", {})
+    return {name: checkpoints[name] for name, _ in get_article_list_shards(data_path) if name in checkpoints}
+
+
+def open_lines(path: str) -> BinaryIO:
+    """Open a file to read its lines in bytes. Files ending with ".gz" or ".zst" are decompressed."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode="rb")
+    if path.endswith(".zst"):
+        import zstandard  # NOTE: an optional dependency needed only for zstd-compressed files.
+
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, mode="rb"), closefd=True))
+    return open(path, mode="rb")
+
+
+def iterate_appended_lines(path: str, checkpoint: dict) -> Iterator[Tuple[str, dict]]:
+    """Yield the lines appended after `checkpoint`, each with the checkpoint to save once the line is processed.
+
+    A checkpoint is the offset of the next line in the (decompressed) file together with the inode and the size of
+    the file. Reading starts over when the file has been rotated (its inode changed) or truncated (it got smaller).
+    A file that has not changed since it was read to the end is not opened.
+    A last line without a newline may be being written, so it is left for the next run.
+    """
+    stat = os.stat(path)
+    offset = checkpoint.get("offset", 0)
+    if checkpoint.get("inode", stat.st_ino) != stat.st_ino:
+        logger.warning(f"{path} has been rotated. Read it from the beginning.")
+        offset = 0
+    elif stat.st_size < checkpoint.get("size", 0) or (not path.endswith((".gz", ".zst")) and stat.st_size < offset):
+        logger.warning(f"{path} has been truncated. Read it from the beginning.")
+        offset = 0
+    elif checkpoint.get("complete") and checkpoint.get("size") == stat.st_size:
+        return
+    logger.debug(f"Skip the first {offset} bytes of {path}.")
+    with open_lines(path) as f:
+        # NOTE: seeking a compressed file decompresses the skipped part.
+        if f.seekable():
+            f.seek(offset)
+        else:
+            remaining = offset
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+        raw_line = f.readline()
+        while raw_line.endswith(b"\n"):
+            offset += len(raw_line)
+            next_raw_line = f.readline()
+            yield raw_line.decode("utf-8", errors="ignore"), {
+                "inode": stat.st_ino,
+                "size": stat.st_size,
+                "offset": offset,
+                "complete": next_raw_line == b"",
             }
-            if d["classes_kwd"].get("オリンピック", 0) == 1:
-                topics_to_score["オリンピック"] = 1.0
-            topics: Dict[str, float] = dict()
-            for idx, (topic, score) in enumerate(
-                sorted(topics_to_score.items(), key=lambda x: x[1], reverse=True)
-            ):
-                if idx == 0 or score > SCORE_THRESHOLD:
-                    topics[topic] = float(score)
+            raw_line = next_raw_line
+
+
+def iterate_article_list(
+    data_path: str, checkpoints: Dict[str, dict], readers: int = 1
+) -> Iterator[Tuple[str, Tuple[str, dict]]]:
+    """Yield the new lines of the article list, each with the name of its file and the checkpoint of the file.
+
+    With more than one reader, files are read by threads and their lines are interleaved. Lines of the same file
+    keep their order, so the last checkpoint of each file is valid once all the yielded lines are processed.
+    """
+    shards = get_article_list_shards(data_path)
+    if readers <= 1 or len(shards) <= 1:
+        for name, path in shards:
+            for line, checkpoint in iterate_appended_lines(path, checkpoints.get(name, {})):
+                yield line, (name, checkpoint)
+        return
+
+    lines = queue.Queue(maxsize=ARTICLE_BATCH_SIZE)  # NOTE: bounds the lines read ahead of the consumer.
+    stopped = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                lines.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(name: str, path: str):
+        try:
+            for line, checkpoint in iterate_appended_lines(path, checkpoints.get(name, {})):
+                if not put((line, (name, checkpoint))):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    with ThreadPoolExecutor(max_workers=readers) as executor:
+        for name, path in shards:
+            executor.submit(read, name, path)
+        try:
+            num_remaining = len(shards)
+            while num_remaining:
+                item = lines.get()
+                if item is done:
+                    num_remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
                 else:
-                    break
-            ja_snippets = reshape_snippets(d["snippets"])
-            en_snippets = reshape_snippets(d["snippets_en"])
-
-            is_checked = 0
-            is_useful = 1 if d["classes_bert"]["is_useful"] > USEFUL_THRESHOLD else 0
-            is_clear = d["classes"]["is_clear"]
-            is_about_false_rumor = d.get("domain", "") == "fij.info"
-
-            domain = d.get("domain", "")
-            ja_domain_label = d.get("domain_label", "")
-            en_domain_label = d.get("domain_label_en", "")
-            sentiment = d.get("sentiment", 0.0)
-            is_positive = 1 if sentiment >= SENTIMENT_THRESHOLD or is_about_false_rumor else 0
-            r = db_handler.upsert_page(
-                {
-                    "country": country,
-                    "displayed_country": country,
-                    "orig": orig,
-                    "ja_translated": ja_translated,
-                    "en_translated": en_translated,
-                    "url": url,
-                    "topics": topics,
-                    "ja_snippets": ja_snippets,
-                    "en_snippets": en_snippets,
-                    "is_checked": is_checked,
-                    "is_hidden": 0,
-                    "is_about_COVID-19": is_about_covid_19,
-                    "is_useful": is_useful,
-                    "is_clear": is_clear,
-                    "is_about_false_rumor": is_about_false_rumor,
-                    "domain": domain,
-                    "ja_domain_label": ja_domain_label,
-                    "en_domain_label": en_domain_label,
-                    "sentiment": sentiment,
-                    "is_positive": is_positive
-                }
+                    yield item
+        finally:
+            stopped.set()
+
+
+def reshape_snippets(snippets: Dict[str, List[str]]) -> Dict[str, str]:
+    # Find a general snippet.
+    general_snippet = ""
+    for itopic in ITOPICS:
+        if itopic in snippets:
+            general_snippet = (
+                snippets[itopic][0] if snippets[itopic] else ""
             )
-            if r and do_tweet and r["status"] == Status.INSERTED and r["is_positive"] and "感染状況" not in topics:
+            break
+
+    # Reshape snippets.
+    reshaped = {}
+    for itopic in ITOPICS:
+        snippets_about_topic = snippets.get(itopic, [])
+        if snippets_about_topic and snippets_about_topic[0]:
+            reshaped[itopic] = snippets_about_topic[0].strip()
+        else:
+            reshaped[itopic] = general_snippet
+    return reshaped
+
+
+def parse_article(line: str) -> Optional[dict]:
+    """Parse a line of the article list into a page document. Return None if the line should be skipped."""
+    try:
+        d = json.loads(line)
+    except json.decoder.JSONDecodeError:
+        return None
+
+    if (
+        not d["orig"]["title"]
+        or not d["ja_translated"]["title"]
+        or not d["en_translated"]["title"]
+    ):
+        return None
+
+    try:
+        if not language_checker.is_lang(d["ja_translated"]["title"], "ja"):
+            logger.warning(
+                f'Skip {d["url"]}: Japanese title is not in Japanese.'
+            )
+            return None
+        if not language_checker.is_lang(d["en_translated"]["title"], "en"):
+            logger.warning(f'Skip {d["url"]}: English title is not in English.')
+            return None
+    except Exception as e:
+        logger.warning(f"Error when detecting the language: {e}")
+        return None
+
+    is_about_covid_19: int = d["classes"]["is_about_COVID-19"]
+    country: str = d["country"]
+    orig: Dict[str, str] = {
+        "title": d["orig"]["title"].strip(),
+        "timestamp": d["orig"]["timestamp"],
+        "simple_timestamp": datetime.fromisoformat(d["orig"]["timestamp"])
+        .date()
+        .isoformat(),
+    }
+    ja_translated: Dict[str, str] = {
+        "title": d["ja_translated"]["title"].strip(),
+        "timestamp": d["ja_translated"]["timestamp"],
+    }
+    en_translated: Dict[str, str] = {
+        "title": d["en_translated"]["title"].strip(),
+        "timestamp": d["en_translated"]["timestamp"],
+    }
+    url: str = d["url"]
+    topics_to_score: Dict[str, float] = {
+        key: value
+        for key, value in d["classes_bert"].items()
+        if key in ITOPICS and value > 0.5
+    }
+    if d["classes_kwd"].get("オリンピック", 0) == 1:
+        topics_to_score["オリンピック"] = 1.0
+    topics: Dict[str, float] = dict()
+    for idx, (topic, score) in enumerate(
+        sorted(topics_to_score.items(), key=lambda x: x[1], reverse=True)
+    ):
+        if idx == 0 or score > SCORE_THRESHOLD:
+            topics[topic] = float(score)
+        else:
+            break
+    ja_snippets = reshape_snippets(d["snippets"])
+    en_snippets = reshape_snippets(d["snippets_en"])
+
+    is_checked = 0
+    is_useful = 1 if d["classes_bert"]["is_useful"] > USEFUL_THRESHOLD else 0
+    is_clear = d["classes"]["is_clear"]
+    is_about_false_rumor = d.get("domain", "") == "fij.info"
+
+    domain = d.get("domain", "")
+    ja_domain_label = d.get("domain_label", "")
+    en_domain_label = d.get("domain_label_en", "")
+    sentiment = d.get("sentiment", 0.0)
+    is_positive = 1 if sentiment >= SENTIMENT_THRESHOLD or is_about_false_rumor else 0
+    return {
+        "country": country,
+        "displayed_country": country,
+        "orig": orig,
+        "ja_translated": ja_translated,
+        "en_translated": en_translated,
+        "url": url,
+        "topics": topics,
+        "ja_snippets": ja_snippets,
+        "en_snippets": en_snippets,
+        "is_checked": is_checked,
+        "is_hidden": 0,
+        "is_about_COVID-19": is_about_covid_19,
+        "is_useful": is_useful,
+        "is_clear": is_clear,
+        "is_about_false_rumor": is_about_false_rumor,
+        "domain": domain,
+        "ja_domain_label": ja_domain_label,
+        "en_domain_label": en_domain_label,
+        "sentiment": sentiment,
+        "is_positive": is_positive
+    }
+
+
+def parse_article_line(item: Tuple[str, Any]) -> Tuple[Optional[dict], Any, Dict[str, int]]:
+    line, checkpoint = item
+    document = parse_article(line)
+    # Hand the counts over to the caller, as they are kept in each worker process.
+    counts = dict(language_checker.counts)
+    language_checker.counts.clear()
+    return document, checkpoint, counts
+
+
+def parse_articles(
+    items: Iterable[Tuple[str, Any]], workers: int = 1, pool: Optional[multiprocessing.pool.Pool] = None
+) -> Iterator[Tuple[Optional[dict], Any, Dict[str, int]]]:
+    """Parse (line, checkpoint) pairs into (document, checkpoint, language check counts) in the input order.
+
+    With more than one worker, lines are parsed by a process pool. A window of lines is parsed in the background
+    while the previous one is consumed, so the memory usage does not depend on the input size.
+    A long-running caller may pass its own `pool` of `workers` processes to keep them warm.
+    """
+    if pool is None:
+        if workers <= 1:
+            yield from map(parse_article_line, items)
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                yield from parse_articles(items, workers, pool)
+        return
+    items = iter(items)
+    window_size = workers * ARTICLE_CHUNK_SIZE * 2
+    pending = None
+    while True:
+        window = list(itertools.islice(items, window_size))
+        submitted = pool.map_async(parse_article_line, window, chunksize=ARTICLE_CHUNK_SIZE) if window else None
+        if pending is not None:
+            yield from pending.get()
+        if submitted is None:
+            break
+        pending = submitted
+
+
+def add_articles(
+    do_tweet: bool = False,
+    workers: int = 1,
+    article_readers: int = 4,
+    pool: Optional[multiprocessing.pool.Pool] = None,
+    stop_event: Optional[threading.Event] = None,
+) -> Tuple[int, List[dict]]:
+    """Add the articles appended to the article list since the last run.
+
+    Return the number of added or updated pages and, with `do_tweet`, the newly added positive pages to tweet.
+    When `stop_event` is set, the pages parsed so far are written and the progress is saved before returning.
+    """
+    logger.debug("Add automatically categorized pages.")
+    data_path = cfg["data"]["article_list"]
+    checkpoints = load_article_list_checkpoints(data_path)
+    num_written = 0
+    maybe_tweeted_ds = []
+
+    def upsert_pages(documents: List[dict]):
+        nonlocal num_written
+        for r in db_handler.upsert_pages(documents):
+            if r["status"] != Status.IGNORED:
+                num_written += 1
+            if do_tweet and r["status"] == Status.INSERTED and r["is_positive"] and "感染状況" not in r["topics"]:
                 maybe_tweeted_ds.append(r)
-        line_num = line_idx
-    with open(cache_file, "w") as f:
-        f.write(f"{line_num}")
+        # NOTE: all the lines up to `checkpoints` are either skipped or written by now.
+        checkpoint_handler.save(ARTICLE_LIST_CHECKPOINT, {"shards": checkpoints})
+
+    buf = []
+    lang_counts = collections.Counter()
+    items = iterate_article_list(data_path, dict(checkpoints), article_readers)
+    for document, (name, checkpoint), counts in parse_articles(items, workers, pool):
+        checkpoints[name] = checkpoint
+        lang_counts.update(counts)
+        if document is not None:
+            buf.append(document)
+        if len(buf) == ARTICLE_BATCH_SIZE:
+            logger.debug(f"Write {ARTICLE_BATCH_SIZE} pages.")
+            upsert_pages(buf)
+            buf = []
+        if stop_event is not None and stop_event.is_set():
+            logger.info("Stop adding articles.")
+            break
+    upsert_pages(buf)
+    logger.debug(
+        "Language checks: "
+        + ", ".join(f"{path}={lang_counts[path]}" for path in ("script", "cache", "langdetect"))
+    )
+    return num_written, maybe_tweeted_ds
+
+
+def update_database(do_tweet: bool = False, workers: int = 1, article_readers: int = 4, tweet_readers: int = 16):
+    ensure_unique_url_index()
+
+    _, maybe_tweeted_ds = add_articles(do_tweet, workers, article_readers)
     num_docs = db_handler.article_coll.count_documents({})
     log_handler.extend_page_number_log(
         [f"{time.asctime()}:The number of pages is {num_docs}."]
     )
 
-    def remove_doublon_articles():
-        doublons = {}
-        for doc in db_handler.article_coll.aggregate(
-                [{"$group": {"_id": "$page.url", "count": {"$sum": 1}}}, {"$match": {"count": {"$gt": 1}}}]):
-            doublons[doc["_id"]] = doc["count"]
-
-        ids_to_remove = []
-        for url in doublons:
-            for index, doc in enumerate(db_handler.article_coll.find({"page.url": url})):
-                if index > 0:
-                    ids_to_remove.append(doc["_id"])
-        logger.debug(f"Remove doublon articles: {len(ids_to_remove)}")
-        if (len(ids_to_remove) > 0):
-            db_handler.article_coll.delete_many({"_id": {"$in": ids_to_remove}})
+    update_manual_checks()
 
-    # For some unexplained reasons, we end up having documents with duplicate page.url values so fix that.
-    remove_doublon_articles()
+    logger.debug("Update the materialized feeds.")
+    num_feeds = db_handler.update_feeds()
+    logger.debug(f"Updated {num_feeds} feeds.")
 
-    logger.debug("Add manually checked pages.")
-    for line in log_handler.iterate_topic_check_log():
-        log = json.loads(line)
-        existing_page = db_handler.article_coll.find_one({"page.url": log["url"]})
-        if not existing_page:
-            continue
-        db_handler.article_coll.update_one(
-            {"page.url": log["url"]},
-            {
-                "$set": {
-                    "page.is_about_COVID-19": log["is_about_COVID-19"],
-                    "page.is_useful": log["is_useful"],
-                    "page.is_about_false_rumor": log.get("is_about_false_rumor", 0),
-                    "page.is_positive": log.get("is_positive", 0),
-                    "page.is_checked": 1,
-                    "page.is_hidden": log.get("is_hidden", 0),
-                    "page.displayed_country": log["new_country"],
-                    "page.topics": {new_topic: 1.0 for new_topic in log["new_topics"]},
-                }
-            },
-        )
+    cache_handler.bump_version()
 
     logger.debug("Tweet a useful new page.")
     if do_tweet:
@@ -231,85 +437,203 @@ def update_database(do_tweet: bool = False):
         twitter_handler.post(text)
 
     logger.debug("Add tweets posted in the last 2 days.")
-    data_path = cfg["data"]["tweet_list"]
+    add_tweets([datetime.today(), datetime.today() - timedelta(1)], readers=tweet_readers)
 
-    def add_tweets(dt: datetime.date):
-        buf = []
-        glob_pat = f'*/orig/{dt.strftime("%Y")}/{dt.strftime("%m")}/{dt.strftime("%d")}/*/*.json'
-        paths = list(pathlib.Path(data_path).glob(glob_pat))
-        logger.debug(f"Number of tweets: {len(paths)}")
-        for path in paths:
-            try:
-                with path.open() as f:
-                    raw_data = json.load(f)
-            except json.decoder.JSONDecodeError:
-                continue
+    logger.debug("Invalidate cached responses.")
+    cache_handler.bump_version()
 
-            meta_path = path.parent.joinpath(f"{path.stem}.metadata")
-            try:
-                with meta_path.open() as f:
-                    meta_data = json.load(f)
-            except json.decoder.JSONDecodeError:
-                continue
+    num_tweets = db_handler.tweet_coll.count_documents({})
+    log_handler.extend_tweet_number_log(
+        [f"{time.asctime()}:The number of tweets is {num_tweets}."]
+    )
 
-            ja_path = pathlib.Path(
-                str(path).replace("orig", "ja_translated").replace(".json", ".txt")
-            )
-            ja_translated_data = ""
-            if ja_path.exists():
-                with ja_path.open(encoding="utf-8") as f:
-                    ja_translated_data = f.read().strip()
 
-            en_path = pathlib.Path(
-                str(path).replace("orig", "en_translated").replace(".json", ".txt")
-            )
-            en_translated_data = ""
-            if en_path.exists():
-                with en_path.open() as f:
-                    en_translated_data = f.read().strip()
-
-            buf.append(
-                Tweet(
-                    _id=raw_data["id_str"],
-                    name=raw_data["user"]["name"],
-                    verified=raw_data["user"]["verified"],
-                    username=raw_data["user"]["screen_name"],
-                    avatar=raw_data["user"]["profile_image_url_https"],
-                    timestamp=datetime.strptime(
-                        raw_data["created_at"], "%a %b %d %H:%M:%S +0000 %Y"
-                    ).strftime("%Y-%m-%d %H:%M:%S"),
-                    simpleTimestamp=datetime.strptime(
-                        raw_data["created_at"], "%a %b %d %H:%M:%S +0000 %Y"
-                    ).strftime("%Y-%m-%d"),
-                    contentOrig=raw_data.get("full_text", "") or raw_data["text"],
-                    contentJaTrans=ja_translated_data,
-                    contentEnTrans=en_translated_data,
-                    retweetCount=meta_data["count"],
-                    # When the language is "ja", "country_code" is overwritten as "jp".
-                    country="jp"
-                    if raw_data["lang"] == "ja"
-                    else meta_data["country_code"].lower()
-                    if meta_data["country_code"]
-                    else "unk",
-                    lang=raw_data["lang"],
-                )
-            )
+def read_tweet_files(path: pathlib.Path) -> Tuple[str, str, str, str]:
+    """Read the original JSON file of a tweet and the metadata and translations next to it."""
+    with path.open() as f:
+        orig = f.read()
+
+    meta_path = path.parent.joinpath(f"{path.stem}.metadata")
+    meta = ""  # NOTE: fails to parse, so the tweet is skipped until its metadata is written.
+    if meta_path.exists():
+        with meta_path.open() as f:
+            meta = f.read()
 
-            if len(buf) == 1000:
-                logger.debug("Write 1000 tweets.")
-                _ = db_handler.upsert_tweets(buf)
-                buf = []
+    ja_path = pathlib.Path(
+        str(path).replace("orig", "ja_translated").replace(".json", ".txt")
+    )
+    ja_translated_data = ""
+    if ja_path.exists():
+        with ja_path.open(encoding="utf-8") as f:
+            ja_translated_data = f.read().strip()
 
-        if buf:
-            _ = db_handler.upsert_tweets(buf)
+    en_path = pathlib.Path(
+        str(path).replace("orig", "en_translated").replace(".json", ".txt")
+    )
+    en_translated_data = ""
+    if en_path.exists():
+        with en_path.open() as f:
+            en_translated_data = f.read().strip()
+
+    return orig, meta, ja_translated_data, en_translated_data
+
+
+def parse_tweet(orig: str, meta: str, ja_translated_data: str, en_translated_data: str) -> Optional[Tweet]:
+    try:
+        raw_data = json.loads(orig)
+        meta_data = json.loads(meta)
+    except json.decoder.JSONDecodeError:
+        return None
+
+    return Tweet(
+        _id=raw_data["id_str"],
+        name=raw_data["user"]["name"],
+        verified=raw_data["user"]["verified"],
+        username=raw_data["user"]["screen_name"],
+        avatar=raw_data["user"]["profile_image_url_https"],
+        timestamp=datetime.strptime(
+            raw_data["created_at"], "%a %b %d %H:%M:%S +0000 %Y"
+        ).strftime("%Y-%m-%d %H:%M:%S"),
+        simpleTimestamp=datetime.strptime(
+            raw_data["created_at"], "%a %b %d %H:%M:%S +0000 %Y"
+        ).strftime("%Y-%m-%d"),
+        contentOrig=raw_data.get("full_text", "") or raw_data["text"],
+        contentJaTrans=ja_translated_data,
+        contentEnTrans=en_translated_data,
+        retweetCount=meta_data["count"],
+        # When the language is "ja", "country_code" is overwritten as "jp".
+        country="jp"
+        if raw_data["lang"] == "ja"
+        else meta_data["country_code"].lower()
+        if meta_data["country_code"]
+        else "unk",
+        lang=raw_data["lang"],
+    )
 
-    add_tweets(datetime.today())
-    add_tweets(datetime.today() - timedelta(1))
 
-    num_tweets = db_handler.tweet_coll.count_documents({})
-    log_handler.extend_tweet_number_log(
-        [f"{time.asctime()}:The number of tweets is {num_tweets}."]
+def map_in_threads(executor: ThreadPoolExecutor, func: Callable, items: Iterable, max_pending: int) -> Iterator:
+    """Like `executor.map`, but submit at most `max_pending` items ahead of the consumer to bound the memory usage."""
+    pending = collections.deque()
+    for item in items:
+        if len(pending) == max_pending:
+            yield pending.popleft().result()
+        pending.append(executor.submit(func, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def add_tweets(dts: List[datetime], readers: int = 16, stop_event: Optional[threading.Event] = None) -> int:
+    """Add the tweets posted on the given dates and return the number of tweets read.
+
+    The files already added are recorded in a manifest with their modification time and size, and only new or
+    changed files are read. The manifest keeps the given dates only, so it does not grow over time.
+    Files are read by `readers` threads, as reading many small files is dominated by the latency of the file system.
+    When `stop_event` is set, the tweets read so far are written and recorded before returning.
+    """
+    data_path = cfg["data"]["tweet_list"]
+    manifest = checkpoint_handler.load(TWEET_MANIFEST_CHECKPOINT)
+    manifest = {dt.strftime("%Y-%m-%d"): manifest.get(dt.strftime("%Y-%m-%d"), {}) for dt in dts}
+    timings = collections.Counter()
+    num_tweets = 0
+
+    def read(path: pathlib.Path, entries: Dict[str, list]) -> Tuple[str, list, Optional[tuple], float]:
+        # NOTE: files are not read if the manifest shows they have been added.
+        start = time.monotonic()
+        key = str(path.relative_to(data_path))
+        stat = path.stat()
+        signature = [stat.st_mtime, stat.st_size]
+        files = None if entries.get(key) == signature else read_tweet_files(path)
+        return key, signature, files, time.monotonic() - start
+
+    def write(tweets: List[Tweet]):
+        nonlocal num_tweets
+        num_tweets += len(tweets)
+        start = time.monotonic()
+        _ = db_handler.upsert_tweets(tweets)
+        timings["write"] += time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=readers) as executor:
+        for dt in dts:
+            if stop_event is not None and stop_event.is_set():
+                break
+            entries = manifest[dt.strftime("%Y-%m-%d")]
+            buf, pending = [], {}
+            start = time.monotonic()
+            glob_pat = f'*/orig/{dt.strftime("%Y")}/{dt.strftime("%m")}/{dt.strftime("%d")}/*/*.json'
+            paths = list(pathlib.Path(data_path).glob(glob_pat))
+            timings["glob"] += time.monotonic() - start
+            logger.debug(f"Number of tweets: {len(paths)}")
+            num_skipped = 0
+            # NOTE: at most one batch of files is read ahead, which keeps the memory usage flat.
+            for key, signature, files, elapsed in map_in_threads(
+                executor, partial(read, entries=entries), paths, TWEET_BATCH_SIZE
+            ):
+                timings["read"] += elapsed
+                if files is None:
+                    num_skipped += 1
+                    continue
+                start = time.monotonic()
+                tweet = parse_tweet(*files)
+                timings["parse"] += time.monotonic() - start
+                if tweet is None:
+                    continue  # NOTE: the file may be being written, so leave it for the next run.
+                buf.append(tweet)
+                pending[key] = signature
+
+                if len(buf) == TWEET_BATCH_SIZE:
+                    logger.debug(f"Write {TWEET_BATCH_SIZE} tweets.")
+                    write(buf)
+                    entries.update(pending)
+                    checkpoint_handler.save(TWEET_MANIFEST_CHECKPOINT, manifest)
+                    buf, pending = [], {}
+                if stop_event is not None and stop_event.is_set():
+                    logger.info("Stop adding tweets.")
+                    break
+
+            if buf:
+                write(buf)
+            entries.update(pending)
+            checkpoint_handler.save(TWEET_MANIFEST_CHECKPOINT, manifest)
+            logger.debug(f"Skipped {num_skipped} tweets added before.")
+
+    # NOTE: "read" is summed over the reader threads, so it can exceed the elapsed time.
+    logger.debug(
+        "Tweet ingestion time: "
+        + ", ".join(f"{stage}={timings[stage]:.2f}s" for stage in ("glob", "read", "parse", "write"))
     )
+    return num_tweets
+
+
+def update_manual_checks(rebuild: bool = False) -> int:
+    """Apply the entries appended to the topic check log since the last run and return the number of updated pages.
+
+    With `rebuild`, replay all of them.
+    """
+    logger.debug("Add manually checked pages.")
+    paths = log_handler.get_topic_check_log_paths()
+    if not paths:
+        logger.debug("No pages have been checked.")
+        return 0
+    checkpoint = {} if rebuild else checkpoint_handler.load(MANUAL_CHECK_CHECKPOINT)
+    # NOTE: a segment keeps the inode of the log it was rotated from, so its checkpoint is found by the inode.
+    inode_to_checkpoint = {cp["inode"]: cp for cp in checkpoint.get("shards", {}).values() if "inode" in cp}
+    checkpoints = {}
+    url_to_log = {}  # NOTE: only the last check of each page matters.
+    for path in paths:
+        name = os.path.basename(path)
+        try:
+            checkpoints[name] = inode_to_checkpoint.get(os.stat(path).st_ino, {})
+            for line, checkpoints[name] in iterate_appended_lines(path, checkpoints[name]):
+                if line.strip():
+                    log = json.loads(line)
+                    url_to_log[log["url"]] = log
+        except FileNotFoundError:
+            # NOTE: the log has been rotated in between. The new segment is read in the next run.
+            checkpoints.pop(name, None)
+    num_pages = db_handler.apply_manual_checks(url_to_log.values())
+    logger.debug(f"Applied the checks of {len(url_to_log)} pages, of which {num_pages} are registered.")
+    checkpoint_handler.save(MANUAL_CHECK_CHECKPOINT, {"shards": checkpoints})
+    return num_pages
 
 
 def update_stats():
@@ -380,6 +704,95 @@ def update_sources():
     meta_data_handler.set_sources(sources)
 
 
+def ensure_indexes():
+    logger.debug("Ensure indexes.")
+    created = db_handler.ensure_indexes()
+    logger.debug(f"Indexes: {created}")
+    collscans = db_handler.verify_indexes()
+    if collscans:
+        logger.warning(f"{len(collscans)} queries fall back to COLLSCAN: {collscans}")
+    else:
+        logger.debug("All the queries use indexes.")
+
+
+def ensure_unique_url_index():
+    if f"{db_handler.article_coll.name}.url" in db_handler.get_missing_indexes():
+        # NOTE: upserts rely on the unique URL index. Creating it removes duplicate pages once.
+        logger.debug(f"Indexes: {db_handler.ensure_indexes()}")
+
+
+def ignore_stop_signals():
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_daemon(
+    workers: int = 1,
+    article_readers: int = 4,
+    tweet_readers: int = 16,
+    interval: float = 60.0,
+    stats_interval: float = 21600.0,
+    sources_interval: float = 86400.0,
+):
+    """Keep adding new articles, manual checks and tweets every `interval` seconds until SIGTERM or SIGINT.
+
+    The database connections, the language detector and the parser processes are kept across iterations. Stats
+    and sources are updated every `stats_interval` and `sources_interval` seconds. On SIGTERM or SIGINT, the data
+    read so far is written and the progress is saved before exiting.
+    """
+    # NOTE: create the parser processes before installing the handlers below, which they must not inherit. They
+    # ignore SIGTERM and SIGINT sent to the whole process group, e.g., by systemd, so that they finish the batch
+    # being parsed, and exit once this process has saved the progress.
+    pool = multiprocessing.Pool(workers, ignore_stop_signals) if workers > 1 else None
+
+    stop_event = threading.Event()
+
+    def stop(signum, _):
+        logger.info(f"Received {signal.Signals(signum).name}. Stop after saving the progress.")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    ensure_unique_url_index()
+
+    jobs = [(update_stats, stats_interval), (update_sources, sources_interval)]
+    next_run_times = [0.0] * len(jobs)
+    try:
+        while not stop_event.is_set():
+            try:
+                num_pages, _ = add_articles(False, workers, article_readers, pool, stop_event)
+                num_pages += update_manual_checks()
+                if num_pages:
+                    logger.debug("Update the materialized feeds.")
+                    db_handler.update_feeds()
+                num_tweets = add_tweets(
+                    [datetime.today(), datetime.today() - timedelta(1)], readers=tweet_readers, stop_event=stop_event
+                )
+                if num_pages or num_tweets:
+                    cache_handler.bump_version()
+            except Exception:
+                # NOTE: the progress is saved batch by batch, so the next iteration resumes from there.
+                logger.exception("Error when adding data. Retry in the next iteration.")
+
+            for i, (job, job_interval) in enumerate(jobs):
+                if stop_event.is_set() or time.monotonic() < next_run_times[i]:
+                    continue
+                try:
+                    job()
+                except Exception:
+                    logger.exception(f"Error when running {job.__name__}.")
+                next_run_times[i] = time.monotonic() + job_interval
+
+            stop_event.wait(interval)
+    finally:
+        if pool is not None:
+            # NOTE: the parser processes ignore SIGTERM, which `terminate` sends. Let them exit once idle.
+            pool.close()
+            pool.join()
+    logger.info("Stopped.")
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -398,17 +811,92 @@ def main():
         action="store_true",
         help="If true, update the source information.",
     )
+    parser.add_argument(
+        "--ensure_indexes",
+        action="store_true",
+        help="If true, create the indexes and report queries that fall back to COLLSCAN.",
+    )
+    parser.add_argument(
+        "--rebuild_manual_checks",
+        action="store_true",
+        help="If true, replay the whole topic check log instead of the entries appended since the last run.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of processes to parse articles.",
+    )
+    parser.add_argument(
+        "--article_readers",
+        type=int,
+        default=4,
+        help="The number of threads to read the files of the article list.",
+    )
+    parser.add_argument(
+        "--tweet_readers",
+        type=int,
+        default=16,
+        help="The number of threads to read tweet files.",
+    )
     parser.add_argument(
         "--do_tweet",
         action="store_true",
         help="If true, randomly tweet a newly registered page.",
     )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="If true, keep adding new data and updating the stats and sources until SIGTERM or SIGINT.",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=60.0,
+        help="The number of seconds between checks for new data in the daemon mode.",
+    )
+    parser.add_argument(
+        "--stats_interval",
+        type=float,
+        default=21600.0,
+        help="The number of seconds between updates of the stats information in the daemon mode.",
+    )
+    parser.add_argument(
+        "--sources_interval",
+        type=float,
+        default=86400.0,
+        help="The number of seconds between updates of the source information in the daemon mode.",
+    )
     args = parser.parse_args()
 
     logging.basicConfig(level="DEBUG")
 
+    if args.ensure_indexes:
+        ensure_indexes()
+
+    if args.daemon:
+        run_daemon(
+            workers=args.workers,
+            article_readers=args.article_readers,
+            tweet_readers=args.tweet_readers,
+            interval=args.interval,
+            stats_interval=args.stats_interval,
+            sources_interval=args.sources_interval,
+        )
+        return
+
     if args.update_all or args.update_database:
-        update_database(do_tweet=args.do_tweet)
+        update_database(
+            do_tweet=args.do_tweet,
+            workers=args.workers,
+            article_readers=args.article_readers,
+            tweet_readers=args.tweet_readers,
+        )
+
+    if args.rebuild_manual_checks:
+        update_manual_checks(rebuild=True)
+        db_handler.update_feeds()
+        cache_handler.bump_version()
 
     if args.update_all or args.update_stats:
         update_stats()
@@ -1,21 +1,125 @@
+import base64
+import binascii
+import copy
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from datetime import datetime, timedelta
 from enum import Enum
-from dataclasses import dataclass, asdict
-from typing import List, Dict, Union, Optional
+from functools import partial
+from dataclasses import dataclass, asdict, fields
+from typing import Any, Callable, Iterable, List, Dict, Hashable, Tuple, Union, Optional
 
+from bson import ObjectId, json_util
 from elasticsearch import Elasticsearch
-from pymongo import MongoClient, UpdateOne, DESCENDING
+from pymongo import MongoClient, ReplaceOne, UpdateOne, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
 
+from cache_handler import CacheHandler
 from util import (
     ITOPICS,
     ITOPIC_ETOPIC_MAP,
+    ICOUNTRY_ECOUNTRY_MAP,
     ETOPIC_ITOPICS_MAP,
     ECOUNTRY_ICOUNTRIES_MAP,
+    LANGUAGES,
     ETOPIC_TRANS_MAP,
     ECOUNTRY_TRANS_MAP,
     SENTIMENT_THRESHOLD
 )
 
+logger = logging.getLogger(__file__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class InvalidCursor(ValueError):
+    """A cursor that is malformed or was issued for another sort order."""
+
+
+# Indexes required by the query shapes below. Create them with `python cron.py --ensure_indexes`.
+ARTICLE_INDEXES = [
+    # NOTE: upserts rely on this index to keep one document per URL.
+    IndexModel([("page.url", ASCENDING)], name="url", unique=True),
+    IndexModel(
+        [
+            ("page.is_about_COVID-19", ASCENDING),
+            ("page.is_hidden", ASCENDING),
+            ("page.orig.simple_timestamp", DESCENDING),
+            ("_id", DESCENDING),
+        ],
+        name="feed",
+    ),
+    IndexModel(
+        [
+            ("page.is_about_COVID-19", ASCENDING),
+            ("page.is_hidden", ASCENDING),
+            ("page.displayed_country", ASCENDING),
+            ("page.orig.simple_timestamp", DESCENDING),
+            ("_id", DESCENDING),
+        ],
+        name="feed_by_country",
+    ),
+] + [
+    # NOTE: sparse indexes serve the `$exists` clauses of the topic filter.
+    IndexModel(
+        [(f"page.topics.{itopic}", ASCENDING), ("page.orig.simple_timestamp", DESCENDING)],
+        name=f"feed_by_topic_{i}",
+        sparse=True,
+    )
+    for i, itopic in enumerate(ITOPICS)
+]
+TWEET_INDEXES = [
+    IndexModel(
+        [
+            ("country", ASCENDING),
+            ("simpleTimestamp", DESCENDING),
+            ("retweetCount", DESCENDING),
+            ("timestamp", DESCENDING),
+            ("_id", DESCENDING),
+        ],
+        name="feed_by_country",
+    ),
+]
+# Fields of a page that `reshape_article` needs. The `{lang}_*` fields are needed for the requested language only.
+PAGE_FIELDS = [
+    "country",
+    "displayed_country",
+    "orig",
+    "url",
+    "topics",
+    "is_checked",
+    "is_hidden",
+    "is_about_COVID-19",
+    "is_useful",
+    "is_clear",
+    "is_about_false_rumor",
+    "domain",
+    "sentiment",
+    "is_positive",
+]
+PAGE_LANG_FIELDS = ["snippets", "translated", "domain_label"]
+# Fields of a page set by moderators, which are kept when the page is updated by a newer version of it.
+MANUAL_CHECK_FIELDS = [
+    "is_about_COVID-19",
+    "is_useful",
+    "is_about_false_rumor",
+    "is_positive",
+    "is_checked",
+    "is_hidden",
+    "displayed_country",
+    "topics",
+]
+
+# The number of articles returned as the positive news, which are published within the last `POSITIVE_DAYS` days.
+POSITIVE_ARTICLE_LIMIT = 5
+POSITIVE_DAYS = 30
+
+FEED_INDEXES = [
+    IndexModel([("articles.url", ASCENDING)], name="url"),
+]
+
 
 class Status(Enum):
     UPDATED = 0
@@ -72,6 +176,12 @@ class DBHandler:
         mongo_tweet_collection_name: str,
         es_host: str,
         es_port: int,
+        max_workers: int = 8,
+        fan_out_timeout: float = 10.0,
+        cache_handler: Optional[CacheHandler] = None,
+        check_indexes: bool = True,
+        mongo_feed_collection_name: str = "feeds",
+        feed_size: int = 100,
     ):
         self.mongo_cli = MongoClient(mongo_host, mongo_port)
         self.mongo_db = self.mongo_cli.get_database(mongo_db_name)
@@ -79,26 +189,283 @@ class DBHandler:
             name=mongo_article_collection_name
         )
         self.tweet_coll = self.mongo_db.get_collection(name=mongo_tweet_collection_name)
+        self.feed_coll = self.mongo_db.get_collection(name=mongo_feed_collection_name)
+        self.feed_size = feed_size
         self.es = Elasticsearch(f"{es_host}:{es_port}")
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.fan_out_timeout = fan_out_timeout
+        self.cache_handler = cache_handler
+        self.local = threading.local()
+        if check_indexes:
+            try:
+                missing_indexes = self.get_missing_indexes()
+            except PyMongoError as e:
+                logger.warning(f"Error when checking the indexes: {e}")
+            else:
+                if missing_indexes:
+                    logger.warning(
+                        f"Missing indexes: {missing_indexes}. Run `python cron.py --ensure_indexes` to create them."
+                    )
+
+    def ensure_indexes(self) -> List[str]:
+        """Create the indexes required by the queries. Existing indexes are left untouched.
+
+        Older databases may have duplicate pages of a URL, with no URL index or a non-unique one. Duplicates are
+        removed before the unique index is created.
+        """
+        url_index = self.article_coll.index_information().get("url")
+        if url_index is None or not url_index.get("unique", False):
+            logger.info("Make the URL index unique.")
+            num_removed = self.remove_duplicate_articles()
+            logger.info(f"Removed {num_removed} duplicate pages.")
+            if url_index is not None:
+                self.article_coll.drop_index("url")
+        return (
+            self.article_coll.create_indexes(ARTICLE_INDEXES)
+            + self.tweet_coll.create_indexes(TWEET_INDEXES)
+            + self.feed_coll.create_indexes(FEED_INDEXES)
+        )
+
+    def get_missing_indexes(self) -> List[str]:
+        missing_indexes = []
+        for coll, indexes in [
+            (self.article_coll, ARTICLE_INDEXES),
+            (self.tweet_coll, TWEET_INDEXES),
+            (self.feed_coll, FEED_INDEXES),
+        ]:
+            index_information = coll.index_information()
+            missing_indexes += [
+                f"{coll.name}.{index.document['name']}"
+                for index in indexes
+                if index.document["name"] not in index_information
+                or index_information[index.document["name"]].get("unique", False)
+                != index.document.get("unique", False)
+            ]
+        return missing_indexes
+
+    def remove_duplicate_articles(self) -> int:
+        """Keep only the newest page of each URL. This is needed once before making the URL index unique."""
+        ids_to_remove = []
+        for doc in self.article_coll.aggregate(
+            [
+                {"$sort": {"page.orig.timestamp": DESCENDING, "_id": ASCENDING}},
+                {"$group": {"_id": "$page.url", "ids": {"$push": "$_id"}}},
+                {"$match": {"ids.1": {"$exists": True}}},
+            ],
+            allowDiskUse=True,
+        ):
+            ids_to_remove += doc["ids"][1:]
+        if ids_to_remove:
+            self.article_coll.delete_many({"_id": {"$in": ids_to_remove}})
+        return len(ids_to_remove)
+
+    def verify_indexes(self) -> List[str]:
+        """Explain the queries issued by this class and return the ones whose plan falls back to COLLSCAN."""
+
+        def has_collscan(plan: dict) -> bool:
+            if plan.get("stage") == "COLLSCAN":
+                return True
+            children = plan.get("inputStages", []) + [
+                plan[key] for key in ("inputStage", "queryPlan") if key in plan
+            ]
+            return any(has_collscan(child) for child in children)
+
+        queries = {
+            "articles by url": (
+                self.article_coll,
+                {"page.url": ""},
+                None,
+            ),
+            "articles of all topics and countries": (
+                self.article_coll,
+                self.get_article_filter(None, None),
+                self.get_article_sort(),
+            ),
+            "positive articles": (
+                self.article_coll,
+                self.get_article_filter("all", "all", sentiment=True),
+                self.get_article_sort(ETOPIC_ITOPICS_MAP["all"], sentiment=True),
+            ),
+            **{
+                f"articles about {etopic} in {ecountry}": (
+                    self.article_coll,
+                    self.get_article_filter(etopic, ecountry),
+                    self.get_article_sort(ETOPIC_ITOPICS_MAP[etopic]),
+                )
+                for etopic in ETOPIC_ITOPICS_MAP.keys()
+                for ecountry in ECOUNTRY_ICOUNTRIES_MAP.keys()
+            },
+            **{
+                f"tweets in {ecountry}": (
+                    self.tweet_coll,
+                    {"country": {"$in": icountries}},
+                    self.get_tweet_sort(),
+                )
+                for ecountry, icountries in ECOUNTRY_ICOUNTRIES_MAP.items()
+            },
+        }
+        collscans = []
+        for name, (coll, filter_, sort_) in queries.items():
+            plan = coll.find(filter=filter_, sort=sort_).limit(1).explain()
+            if has_collscan(plan["queryPlanner"]["winningPlan"]):
+                logger.warning(f"The query for {name} falls back to COLLSCAN.")
+                collscans.append(name)
+        return collscans
+
+    def fan_out(
+        self,
+        calls: Dict[Hashable, Callable[[], Any]],
+        timeout: Optional[float] = None,
+        default_factory: Callable[[], Any] = list,
+    ) -> Dict[Hashable, Any]:
+        """Run independent per-cell queries concurrently and return their results in the order of `calls`.
+
+        All the calls share one deadline of `timeout` seconds, which defaults to `fan_out_timeout`.
+        A call that fails or misses the deadline is logged and its result is replaced with `default_factory()`,
+        which `pop_is_partial` reports.
+        """
+        futures = {key: self.executor.submit(call) for key, call in calls.items()}
+        deadline = time.monotonic() + (self.fan_out_timeout if timeout is None else timeout)
+        results = {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except TimeoutError:
+                future.cancel()
+                logger.warning(f"Timed out when querying {key}.")
+                results[key] = default_factory()
+                self.local.is_partial = True
+            except Exception as e:
+                logger.warning(f"Error when querying {key}: {e}")
+                results[key] = default_factory()
+                self.local.is_partial = True
+        return results
+
+    def pop_is_partial(self) -> bool:
+        """Return True if a query failed in this thread since the last call, leaving a partial result."""
+        is_partial = getattr(self.local, "is_partial", False)
+        self.local.is_partial = False
+        return is_partial
 
     def upsert_page(self, document: dict) -> Optional[Dict[str, str]]:
         """Add a page to the database. If the page has already been registered, update the page."""
-        existing_page = self.article_coll.find_one({"page.url": document["url"]})
-        if (
-            existing_page
-            and document["orig"]["timestamp"]
-            > existing_page["page"]["orig"]["timestamp"]
-        ):
-            self.article_coll.update_one(
-                {"page.url": document["url"]}, {"$set": {"page": document}}, upsert=True
+        return self.upsert_pages([document])[0]
+
+    def upsert_pages(self, documents: List[dict]) -> List[dict]:
+        """Add pages to the database in bulk. A registered page is updated only when the given one is newer.
+
+        Each URL is written once, with the newest of the given documents, and each document gets its `status`.
+        Documents superseded by a newer one of the same URL are IGNORED. The fields checked by moderators are kept.
+        """
+        url_to_document = {}
+        for document in documents:
+            url = document["url"]
+            if url not in url_to_document or document["orig"]["timestamp"] > url_to_document[url]["orig"]["timestamp"]:
+                url_to_document[url] = document
+        if not url_to_document:
+            return documents
+        url_to_manual_check = {
+            doc["page"]["url"]: doc["page"]
+            for doc in self.article_coll.find(
+                {"page.url": {"$in": list(url_to_document.keys())}, "page.is_checked": 1},
+                projection={"_id": 0, "page.url": 1, **{f"page.{field}": 1 for field in MANUAL_CHECK_FIELDS}},
             )
-            document["status"] = Status.UPDATED
-        elif not existing_page:
-            self.article_coll.insert_one({"page": document})
-            document["status"] = Status.INSERTED
-        else:
-            document["status"] = Status.IGNORED
-        return document
+        }
+        url_to_status = self.write_pages(list(url_to_document.values()))
+        self.restore_manual_checks(
+            {
+                url: manual_check
+                for url, manual_check in url_to_manual_check.items()
+                if url_to_status[url] == Status.UPDATED
+            }
+        )
+        # NOTE: set statuses after writing not to store them.
+        for document in documents:
+            if url_to_document[document["url"]] is document:
+                document["status"] = url_to_status[document["url"]]
+            else:
+                document["status"] = Status.IGNORED
+        return documents
+
+    def write_pages(self, documents: List[dict], retry: bool = True) -> Dict[str, Status]:
+        """Upsert pages of distinct URLs atomically and return the status of each URL.
+
+        The filter matches a registered page only when it is older. Otherwise the upsert tries to insert a second
+        page of the URL, which the unique index rejects, so the page is left as is.
+        """
+        if not documents:
+            return {}
+        writes = [
+            UpdateOne(
+                {"page.url": document["url"], "page.orig.timestamp": {"$lt": document["orig"]["timestamp"]}},
+                {"$set": {"page": document}},
+                upsert=True,
+            )
+            for document in documents
+        ]
+        try:
+            result = self.article_coll.bulk_write(writes, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            other_errors = [error for error in result["writeErrors"] if error["code"] != DUPLICATE_KEY_ERROR]
+            if other_errors:
+                raise
+        upserted_indexes = {upserted["index"] for upserted in result["upserted"]}
+        rejected_indexes = {error["index"] for error in result["writeErrors"]}
+        url_to_status = {}
+        for i, document in enumerate(documents):
+            if i in upserted_indexes:
+                url_to_status[document["url"]] = Status.INSERTED
+            elif i in rejected_indexes:
+                url_to_status[document["url"]] = Status.IGNORED
+            else:
+                url_to_status[document["url"]] = Status.UPDATED
+        if retry and rejected_indexes:
+            # A concurrent writer may have inserted the URL after our filter missed it, in which case the page
+            # was not compared with ours yet. Now that it exists, the filter compares the timestamps.
+            url_to_status.update(self.write_pages([documents[i] for i in sorted(rejected_indexes)], retry=False))
+        return url_to_status
+
+    def restore_manual_checks(self, url_to_manual_check: Dict[str, dict]) -> None:
+        writes = [
+            UpdateOne(
+                {"page.url": url},
+                {"$set": {f"page.{field}": value for field, value in manual_check.items() if field != "url"}},
+            )
+            for url, manual_check in url_to_manual_check.items()
+        ]
+        if writes:
+            self.article_coll.bulk_write(writes, ordered=False)
+
+    def apply_manual_checks(self, logs: Iterable[dict]) -> int:
+        """Apply entries of the topic check log in one bulk write and return the number of matched pages.
+
+        When a URL appears more than once, its last entry wins. Entries of unregistered pages are ignored.
+        """
+        url_to_log = {}
+        for log in logs:
+            url_to_log[log["url"]] = log
+        writes = [
+            UpdateOne(
+                {"page.url": url},
+                {
+                    "$set": {
+                        "page.is_about_COVID-19": log["is_about_COVID-19"],
+                        "page.is_useful": log["is_useful"],
+                        "page.is_about_false_rumor": log.get("is_about_false_rumor", 0),
+                        "page.is_positive": log.get("is_positive", 0),
+                        "page.is_checked": 1,
+                        "page.is_hidden": log.get("is_hidden", 0),
+                        "page.displayed_country": log["new_country"],
+                        "page.topics": {new_topic: 1.0 for new_topic in log["new_topics"]},
+                    }
+                },
+            )
+            for url, log in url_to_log.items()
+        ]
+        if not writes:
+            return 0
+        return self.article_coll.bulk_write(writes, ordered=False).matched_count
 
     def upsert_tweets(self, tweets: List[Tweet]) -> Status:
         upserts = [
@@ -109,7 +476,14 @@ class DBHandler:
         return Status.INSERTED
 
     def get_articles_sorted_by_topic(
-        self, etopic: str, ecountry: str, start: int, limit: int, lang: str, query: str
+        self,
+        etopic: str,
+        ecountry: str,
+        start: int,
+        limit: int,
+        lang: str,
+        query: str,
+        cursor: Optional[str] = None,
     ):
         etopic = ETOPIC_TRANS_MAP.get((etopic, "ja"), etopic)
         ecountry = ECOUNTRY_TRANS_MAP.get((ecountry, "ja"), ecountry)
@@ -119,35 +493,38 @@ class DBHandler:
             ) or ecountry not in ECOUNTRY_ICOUNTRIES_MAP:
                 return []
             reshaped_pages = self.get_articles(
-                etopic, ecountry, start, limit, lang, query
+                etopic, ecountry, start, limit, lang, query, cursor=cursor
             )
         elif etopic:
-            reshaped_pages = {}
-            for ecountry in filter(
+            ecountries = filter(
                 lambda ecountry_: ecountry_ != "all", ECOUNTRY_ICOUNTRIES_MAP.keys()
-            ):
-                if etopic != "search" and etopic not in ETOPIC_ITOPICS_MAP:
-                    reshaped_pages[ecountry] = []
-                else:
-                    reshaped_pages[ecountry] = self.get_articles(
-                        etopic, ecountry, start, limit, lang, query
-                    )
+            )
+            if etopic != "search" and etopic not in ETOPIC_ITOPICS_MAP:
+                reshaped_pages = {ecountry: [] for ecountry in ecountries}
+            elif etopic == "search":
+                reshaped_pages = self.search_articles(list(ecountries), start, limit, lang, query)
+            else:
+                reshaped_pages = self.fan_out(
+                    {
+                        ecountry: partial(
+                            self.get_articles, etopic, ecountry, start, limit, lang, query
+                        )
+                        for ecountry in ecountries
+                    }
+                )
         else:
-            reshaped_pages = {}
-            for etopic in filter(
-                lambda etopic_: etopic_ != "all", ETOPIC_ITOPICS_MAP.keys()
-            ):
-                reshaped_pages[etopic] = {}
-                for ecountry in filter(
-                    lambda ecountry_: ecountry_ != "all", ECOUNTRY_ICOUNTRIES_MAP.keys()
-                ):
-                    reshaped_pages[etopic][ecountry] = self.get_articles(
-                        etopic, ecountry, start, limit, lang, ""
-                    )
+            reshaped_pages = self.get_articles_grid(start, limit, lang)
         return reshaped_pages
 
     def get_articles_sorted_by_country(
-        self, ecountry: str, etopic: str, start: int, limit: int, lang: str, query: str
+        self,
+        ecountry: str,
+        etopic: str,
+        start: int,
+        limit: int,
+        lang: str,
+        query: str,
+        cursor: Optional[str] = None,
     ):
         ecountry = ECOUNTRY_TRANS_MAP.get((ecountry, "ja"), ecountry)
         etopic = ETOPIC_TRANS_MAP.get((etopic, "ja"), etopic)
@@ -157,17 +534,21 @@ class DBHandler:
             ) or ecountry not in ECOUNTRY_ICOUNTRIES_MAP:
                 return []
             reshaped_pages = self.get_articles(
-                etopic, ecountry, start, limit, lang, query
+                etopic, ecountry, start, limit, lang, query, cursor=cursor
             )
         elif ecountry:
-            reshaped_pages = {}
-            for etopic in filter(
-                lambda ecountry_: ecountry_ != "all", ETOPIC_ITOPICS_MAP.keys()
-            ):
-                reshaped_pages[etopic] = self.get_articles(
-                    etopic, ecountry, start, limit, lang, query
-                )
+            reshaped_pages = self.fan_out(
+                {
+                    etopic: partial(
+                        self.get_articles, etopic, ecountry, start, limit, lang, query
+                    )
+                    for etopic in filter(
+                        lambda ecountry_: ecountry_ != "all", ETOPIC_ITOPICS_MAP.keys()
+                    )
+                }
+            )
         else:
+            grid = self.get_articles_grid(start, limit, lang)
             reshaped_pages = {}
             for ecountry in filter(
                 lambda ecountry_: ecountry_ != "all", ECOUNTRY_ICOUNTRIES_MAP.keys()
@@ -176,113 +557,447 @@ class DBHandler:
                 for etopic in filter(
                     lambda etopic_: etopic_ != "all", ETOPIC_ITOPICS_MAP.keys()
                 ):
-                    reshaped_pages[ecountry][etopic] = self.get_articles(
-                        etopic, ecountry, start, limit, lang, ""
-                    )
+                    reshaped_pages[ecountry][etopic] = grid[etopic][ecountry]
         return reshaped_pages
 
     def get_articles(
-        self, etopic: str, ecountry: str, start: int, limit: int, lang: str, query: str, sentiment: bool = False
+        self,
+        etopic: str,
+        ecountry: str,
+        start: int,
+        limit: int,
+        lang: str,
+        query: str,
+        sentiment: bool = False,
+        cursor: Optional[str] = None,
+        use_feed: bool = True,
     ):
-        # Utility functions.
-        def get_sort(itopics_: List[str] = None):
-            sort_ = [("page.orig.simple_timestamp", DESCENDING)]
-            if itopics_:
-                sort_ += [(f"page.topics.{itopic}", DESCENDING) for itopic in itopics_]
-            return sort_
-
-        def trim_snippet(search_snippet: str):
-            if len(search_snippet) <= 70:
-                return search_snippet
-            else:
-                split = search_snippet.split("<em>")
-                prev_context, rest = split[0], "<em>".join(split[1:])
-                prev_context = prev_context.split("、")[-1]
-                return f"{prev_context}<em>{rest}"
+        """Get articles in a (topic, country) cell.
 
-        def reshape_article(doc: dict, search_snippet=None) -> dict:
-            doc["topics"] = [
-                {
-                    "name": ETOPIC_TRANS_MAP[(ITOPIC_ETOPIC_MAP[itopic], lang)],
-                    "snippet": doc[f"{lang}_snippets"][itopic],
-                    "relatedness": doc["topics"][itopic],
-                }
-                for itopic in doc["topics"]
-                if itopic in ITOPICS
-            ]
-            if search_snippet:
-                doc["topics"].append(
-                    {
-                        "name": "Search",
-                        "snippet": search_snippet[0],
-                        "relatedness": -1.0,
-                    }
-                )
-            doc["translated"] = doc[f"{lang}_translated"]
-            doc["domain_label"] = doc[f"{lang}_domain_label"]
-            doc["is_about_false_rumor"] = (
-                1 if doc["domain"] == "fij.info" else doc["is_about_false_rumor"]
-            )
-            del doc["ja_snippets"]
-            del doc["en_snippets"]
-            del doc["ja_translated"]
-            del doc["en_translated"]
-            del doc["ja_domain_label"]
-            del doc["en_domain_label"]
-            return doc
+        When `cursor` is given, the articles after the one that `cursor` was issued for are returned and `start` is
+        ignored. Every returned article has its own `cursor` to resume from it. Search results do not support cursors.
 
+        Pages within the first `feed_size` articles are read from the materialized feed when it exists.
+        """
         # Use ElasticSearch to search for articles.
         if etopic and etopic == "search":
-            icountries = ECOUNTRY_ICOUNTRIES_MAP.get(ecountry, [])
             r = self.es.search(
-                index="covid19-pages-ja" if lang == "ja" else "covid19-pages-en",
-                body={
-                    "query": {
-                        "bool": {
-                            "must": [
-                                {
-                                    "bool": {
-                                        "should": [
-                                            {"term": {"region": icountry}}
-                                            for icountry in icountries
-                                        ]
-                                    }
-                                },
-                                {"match": {"text": query}},
-                            ]
-                        }
-                    },
-                    "highlight": {"fields": {"text": {}}},
-                    "sort": [
-                        {
-                            "timestamp.local": {
-                                "order": "desc",
-                                "nested": {"path": "timestamp"},
-                            }
-                        }
-                    ],
-                    "from": start,
-                    "size": limit,
-                },
+                index=self.get_article_search_index(lang),
+                body=self.get_article_search_body(ecountry, start, limit, query),
             )
             hits = r["hits"]["hits"]
             if len(hits) == 0:
                 return []
+            return self.get_articles_from_hits({ecountry: hits}, lang)[ecountry]
 
-            url_to_hit = {hit["_source"]["url"]: hit for hit in hits}
-            cur = self.article_coll.find(
-                filter={"$or": [{"page.url": hit["_source"]["url"]} for hit in hits]},
-                sort=get_sort(),
+        # Use the materialized feed if it covers the requested page.
+        if use_feed and not sentiment and not cursor and start + limit <= self.feed_size:
+            feed = self.feed_coll.find_one(
+                {"_id": self.get_feed_key(etopic, ecountry, lang)},
+                projection={"articles": {"$slice": [start, limit]}, "is_complete": 1},
             )
-            return [
-                reshape_article(
-                    d["page"],
-                    trim_snippet(url_to_hit[d["page"]["url"]]["highlight"]["text"]),
-                )
-                for d in cur
-            ]
+            if feed is not None and self.feed_covers(feed, limit):
+                return feed["articles"]
 
         # Use MongoDB to search for articles.
+        filter_ = self.get_article_filter(etopic, ecountry, sentiment)
+        sort_ = self.get_article_sort(ETOPIC_ITOPICS_MAP.get(etopic, []), sentiment)
+        if cursor:
+            filter_ = {"$and": [filter_, self.get_keyset_filter(sort_, self.decode_cursor(cursor))]}
+            start = 0
+        cur = self.article_coll.find(
+            filter=filter_, projection=self.get_article_projection(lang), sort=sort_
+        )
+        reshaped_articles = [
+            # NOTE: the cursor must be taken before `reshape_article` overwrites the topic scores.
+            {"cursor": self.get_cursor(doc, sort_), **self.reshape_article(doc["page"], lang)}
+            for doc in cur.skip(start).limit(limit)
+        ]
+        return reshaped_articles
+
+    def get_articles_grid(
+        self, start: int, limit: int, lang: str
+    ) -> Dict[str, Dict[str, List[dict]]]:
+        """Get articles for every (topic, country) cell.
+
+        The cells covered by the materialized feeds are read in one query. Each of the others is an indexed query of
+        its own, and the queries run concurrently.
+        """
+        etopics = [etopic for etopic in ETOPIC_ITOPICS_MAP.keys() if etopic != "all"]
+        ecountries = [
+            ecountry for ecountry in ECOUNTRY_ICOUNTRIES_MAP.keys() if ecountry != "all"
+        ]
+
+        # Use the materialized feeds of the cells they cover, and query the others.
+        cells = {}
+        if start + limit <= self.feed_size:
+            key_to_cell = {
+                self.get_feed_key(etopic, ecountry, lang): (etopic, ecountry)
+                for etopic in etopics
+                for ecountry in ecountries
+            }
+            for feed in self.feed_coll.find(
+                {"_id": {"$in": list(key_to_cell.keys())}},
+                projection={"articles": {"$slice": [start, limit]}, "is_complete": 1},
+            ):
+                if self.feed_covers(feed, limit):
+                    cells[key_to_cell[feed["_id"]]] = feed["articles"]
+        cells.update(
+            self.fan_out(
+                {
+                    (etopic, ecountry): partial(
+                        self.get_articles, etopic, ecountry, start, limit, lang, "", use_feed=False
+                    )
+                    for etopic in etopics
+                    for ecountry in ecountries
+                    if (etopic, ecountry) not in cells
+                }
+            )
+        )
+        return {
+            etopic: {ecountry: cells[(etopic, ecountry)] for ecountry in ecountries}
+            for etopic in etopics
+        }
+
+    @staticmethod
+    def get_article_search_index(lang: str) -> str:
+        return "covid19-pages-ja" if lang == "ja" else "covid19-pages-en"
+
+    @staticmethod
+    def get_article_search_body(ecountry: str, start: int, limit: int, query: str) -> dict:
+        icountries = ECOUNTRY_ICOUNTRIES_MAP.get(ecountry, [])
+        return {
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "bool": {
+                                "should": [
+                                    {"term": {"region": icountry}}
+                                    for icountry in icountries
+                                ]
+                            }
+                        },
+                        {"match": {"text": query}},
+                    ]
+                }
+            },
+            "highlight": {"fields": {"text": {}}},
+            "sort": [
+                {
+                    "timestamp.local": {
+                        "order": "desc",
+                        "nested": {"path": "timestamp"},
+                    }
+                }
+            ],
+            "from": start,
+            "size": limit,
+        }
+
+    @staticmethod
+    def get_tweet_search_index(lang: str) -> str:
+        return "covid19-tweets-ja" if lang == "ja" else "covid19-tweets-en"
+
+    @staticmethod
+    def get_tweet_search_body(ecountry: str, start: int, limit: int, query: str) -> dict:
+        icountries = ECOUNTRY_ICOUNTRIES_MAP.get(ecountry, [])
+        return {
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "bool": {
+                                "should": [
+                                    {"term": {"country": icountry}}
+                                    for icountry in icountries
+                                ]
+                            }
+                        },
+                        {"match": {"text": query}},
+                    ]
+                }
+            },
+            "sort": [
+                {
+                    "timestamp.local": {
+                        "order": "desc",
+                        "nested": {"path": "timestamp"},
+                    }
+                }
+            ],
+            "from": start,
+            "size": limit,
+        }
+
+    def multi_search(
+        self, index: str, bodies: Dict[Hashable, dict]
+    ) -> Dict[Hashable, List[dict]]:
+        """Run searches in a single `_msearch` request and return the hits of each search.
+
+        A search that fails is logged and its hits are replaced with an empty list, which `pop_is_partial` reports.
+        """
+        request = []
+        for body in bodies.values():
+            request += [{"index": index}, body]
+        responses = self.es.msearch(body=request)["responses"]
+        hits_by_key = {}
+        for key, response in zip(bodies.keys(), responses):
+            if "error" in response:
+                logger.warning(f"Error when searching {key}: {response['error']}")
+                hits_by_key[key] = []
+                self.local.is_partial = True
+            else:
+                hits_by_key[key] = response["hits"]["hits"]
+        return hits_by_key
+
+    def search_articles(
+        self, ecountries: List[str], start: int, limit: int, lang: str, query: str
+    ) -> Dict[str, List[dict]]:
+        """Search for articles in several countries with one `_msearch` request and one MongoDB query."""
+        hits_by_ecountry = self.multi_search(
+            self.get_article_search_index(lang),
+            {
+                ecountry: self.get_article_search_body(ecountry, start, limit, query)
+                for ecountry in ecountries
+            },
+        )
+        return self.get_articles_from_hits(hits_by_ecountry, lang)
+
+    def search_tweets(
+        self, ecountries: List[str], start: int, limit: int, lang: str, query: str
+    ) -> Dict[str, List[dict]]:
+        """Search for tweets in several countries with one `_msearch` request and one MongoDB query."""
+        hits_by_ecountry = self.multi_search(
+            self.get_tweet_search_index(lang),
+            {
+                ecountry: self.get_tweet_search_body(ecountry, start, limit, query)
+                for ecountry in ecountries
+            },
+        )
+        return self.get_tweets_from_hits(hits_by_ecountry, lang)
+
+    def get_articles_from_hits(
+        self, hits_by_key: Dict[Hashable, List[dict]], lang: str
+    ) -> Dict[Hashable, List[dict]]:
+        """Reshape the search hits of each key into articles in the order of Elasticsearch.
+
+        A hit whose `_source` holds all the fields of a page is reshaped as it is.
+        The other hits of all the keys are joined with MongoDB by a single `$in` query.
+        """
+        page_fields = PAGE_FIELDS + [f"{lang}_{field}" for field in PAGE_LANG_FIELDS]
+        urls_to_join = [
+            hit["_source"]["url"]
+            for hits in hits_by_key.values()
+            for hit in hits
+            if not all(field in hit["_source"] for field in page_fields)
+        ]
+        url_to_page = {}
+        if urls_to_join:
+            for doc in self.article_coll.find(
+                filter={"page.url": {"$in": urls_to_join}},
+                projection=self.get_article_projection(lang),
+            ):
+                url_to_page[doc["page"]["url"]] = doc["page"]
+        articles_by_key = {}
+        for key, hits in hits_by_key.items():
+            articles_by_key[key] = []
+            for hit in hits:
+                source = hit["_source"]
+                if all(field in source for field in page_fields):
+                    page = {field: source[field] for field in page_fields}
+                elif source["url"] in url_to_page:
+                    # NOTE: copy the page as `reshape_article` modifies it and the same page can be hit twice.
+                    page = dict(url_to_page[source["url"]])
+                else:
+                    continue
+                articles_by_key[key].append(
+                    self.reshape_article(page, lang, self.trim_snippet(hit["highlight"]["text"]))
+                )
+        return articles_by_key
+
+    def get_tweets_from_hits(
+        self, hits_by_key: Dict[Hashable, List[dict]], lang: str
+    ) -> Dict[Hashable, List[dict]]:
+        """Convert the search hits of each key into tweets in the order of Elasticsearch.
+
+        A hit whose `_source` holds all the fields of a tweet is used as it is.
+        The other hits of all the keys are joined with MongoDB by a single `$in` query.
+        """
+        tweet_fields = [field.name for field in fields(Tweet) if field.name != "_id"]
+        ids_to_join = [
+            hit["_id"]
+            for hits in hits_by_key.values()
+            for hit in hits
+            if not all(field in hit["_source"] for field in tweet_fields)
+        ]
+        id_to_doc = {}
+        if ids_to_join:
+            id_to_doc = {doc["_id"]: doc for doc in self.tweet_coll.find(filter={"_id": {"$in": ids_to_join}})}
+        tweets_by_key = {}
+        for key, hits in hits_by_key.items():
+            tweets_by_key[key] = []
+            for hit in hits:
+                if all(field in hit["_source"] for field in tweet_fields):
+                    doc = {"_id": hit["_id"], **{field: hit["_source"][field] for field in tweet_fields}}
+                elif hit["_id"] in id_to_doc:
+                    doc = id_to_doc[hit["_id"]]
+                else:
+                    continue
+                tweets_by_key[key].append(Tweet(**doc).as_api_ret(lang))
+        return tweets_by_key
+
+    @staticmethod
+    def get_feed_key(etopic: str, ecountry: str, lang: str, sentiment: bool = False) -> str:
+        return f"positive|{etopic}|{ecountry}|{lang}" if sentiment else f"{etopic}|{ecountry}|{lang}"
+
+    @staticmethod
+    def get_feed_cells() -> List[Tuple[str, str, str, bool]]:
+        """List the (topic, country, language, sentiment) cells served by the materialized feeds.
+
+        The positive news is served per topic or per country, as requested by `/positive_articles`.
+        """
+        cells = [
+            (etopic, ecountry, lang, False)
+            for etopic in ETOPIC_ITOPICS_MAP.keys()
+            for ecountry in ECOUNTRY_ICOUNTRIES_MAP.keys()
+            for lang in LANGUAGES
+        ]
+        cells += [
+            (etopic, ecountry, lang, True)
+            for etopic, ecountry in {("all", ecountry) for ecountry in ECOUNTRY_ICOUNTRIES_MAP.keys()}
+            | {(etopic, "all") for etopic in ETOPIC_ITOPICS_MAP.keys()}
+            for lang in LANGUAGES
+        ]
+        return cells
+
+    def update_feeds(
+        self, cells: Optional[Iterable[Tuple[str, str, str, bool]]] = None, timeout: float = 600.0
+    ) -> int:
+        """Materialize the reshaped articles of (topic, country, language, sentiment) cells.
+
+        A feed holds the first `feed_size` articles, or the first `POSITIVE_ARTICLE_LIMIT` articles for the
+        positive news, and `is_complete` tells if they are all the articles of the cell. All the cells are updated
+        unless `cells` is given. A cell whose query fails keeps its previous feed.
+        """
+        if cells is None:
+            cells = self.get_feed_cells()
+        results = self.fan_out(
+            {
+                (etopic, ecountry, lang, sentiment): partial(
+                    self.get_articles,
+                    etopic,
+                    ecountry,
+                    0,
+                    POSITIVE_ARTICLE_LIMIT if sentiment else self.feed_size,
+                    lang,
+                    "",
+                    sentiment=sentiment,
+                    use_feed=False,
+                )
+                for etopic, ecountry, lang, sentiment in cells
+            },
+            timeout=timeout,
+            default_factory=lambda: None,
+        )
+        updated_at = datetime.now().isoformat()
+        replaces = [
+            ReplaceOne(
+                {"_id": self.get_feed_key(etopic, ecountry, lang, sentiment)},
+                {
+                    "etopic": etopic,
+                    "ecountry": ecountry,
+                    "lang": lang,
+                    "sentiment": sentiment,
+                    "articles": articles,
+                    "is_complete": len(articles) < (POSITIVE_ARTICLE_LIMIT if sentiment else self.feed_size),
+                    "revision": ObjectId(),
+                    "updated_at": updated_at,
+                },
+                upsert=True,
+            )
+            for (etopic, ecountry, lang, sentiment), articles in results.items()
+            if articles is not None
+        ]
+        if replaces:
+            self.feed_coll.bulk_write(replaces, ordered=False)
+        return len(replaces)
+
+    @staticmethod
+    def feed_covers(feed: dict, limit: int) -> bool:
+        """Return True if the slice of a feed is the requested page, which it is not when the feed got short."""
+        return len(feed["articles"]) >= limit or feed.get("is_complete", False)
+
+    def update_feeds_of_page(self, url: str, icountry: str, etopics: List[str]) -> int:
+        """Patch the feeds in place after a page is edited, and return the number of patched feeds.
+
+        The page is removed from the feeds that contain it and inserted into the cells it belongs to now, at the
+        position given by the sort values in the cursors of the stored articles. A feed the page was removed from
+        is one article short until `update_feeds` rebuilds it, so a page at its end is queried instead.
+        """
+        num_patched = self.feed_coll.update_many(
+            {"articles.url": url}, {"$pull": {"articles": {"url": url}}, "$set": {"revision": ObjectId()}}
+        ).modified_count
+        lang_to_doc = {
+            lang: self.article_coll.find_one({"page.url": url}, projection=self.get_article_projection(lang))
+            for lang in LANGUAGES
+        }
+        for lang, doc in lang_to_doc.items():
+            # NOTE: `update_page` upserts a stub with the moderation fields only for a URL that has not been crawled.
+            if doc is not None and (f"{lang}_snippets" not in doc["page"] or "orig" not in doc["page"]):
+                lang_to_doc[lang] = None
+        ecountries = ["all"] + ([ICOUNTRY_ECOUNTRY_MAP[icountry]] if icountry in ICOUNTRY_ECOUNTRY_MAP else [])
+        etopics = ["all"] + [etopic for etopic in etopics if etopic in ETOPIC_ITOPICS_MAP]
+        cell_to_match = {}
+        for etopic, ecountry, lang, sentiment in self.get_feed_cells():
+            if etopic not in etopics or ecountry not in ecountries or lang_to_doc[lang] is None:
+                continue
+            if (etopic, ecountry, sentiment) not in cell_to_match:
+                filter_ = {"$and": [{"page.url": url}, self.get_article_filter(etopic, ecountry, sentiment)]}
+                cell_to_match[(etopic, ecountry, sentiment)] = self.article_coll.count_documents(filter_, limit=1) > 0
+            if not cell_to_match[(etopic, ecountry, sentiment)]:
+                continue
+            sort_ = self.get_article_sort(ETOPIC_ITOPICS_MAP.get(etopic, []), sentiment)
+            doc = copy.deepcopy(lang_to_doc[lang])
+            # NOTE: the cursor must be taken before `reshape_article` overwrites the topic scores.
+            article = {"cursor": self.get_cursor(doc, sort_), **self.reshape_article(doc["page"], lang)}
+            num_patched += self.insert_into_feed(
+                self.get_feed_key(etopic, ecountry, lang, sentiment),
+                article,
+                POSITIVE_ARTICLE_LIMIT if sentiment else self.feed_size,
+            )
+        return num_patched
+
+    def insert_into_feed(self, key: str, article: dict, size: int) -> int:
+        """Insert an article into a feed keeping the order. Return 0 if it does not belong to the first `size`."""
+
+        def get_sort_values(cursor: str) -> tuple:
+            # NOTE: every key is sorted in descending order, and missing values come last.
+            return tuple((value is not None, value) for _, value in self.decode_cursor(cursor))
+
+        feed = self.feed_coll.find_one({"_id": key}, projection={"articles.cursor": 1, "is_complete": 1, "revision": 1})
+        if feed is None:
+            return 0  # NOTE: `update_feeds` builds it.
+        sort_values = get_sort_values(article["cursor"])
+        position = next(
+            (i for i, stored in enumerate(feed["articles"]) if get_sort_values(stored["cursor"]) < sort_values),
+            len(feed["articles"]),
+        )
+        if position >= size or (position == len(feed["articles"]) and not feed.get("is_complete", False)):
+            return 0
+        # NOTE: skip the patch if the feed has changed since it was read. `update_feeds` catches up with it.
+        return self.feed_coll.update_one(
+            {"_id": key, "revision": feed.get("revision")},
+            {
+                "$push": {"articles": {"$each": [article], "$position": position, "$slice": size}},
+                "$set": {"revision": ObjectId()},
+            },
+        ).modified_count
+
+    @staticmethod
+    def get_article_filter(
+        etopic: Optional[str], ecountry: Optional[str], sentiment: bool = False
+    ) -> dict:
         itopics = ETOPIC_ITOPICS_MAP.get(etopic, [])
         icountries = ECOUNTRY_ICOUNTRIES_MAP.get(ecountry, [])
 
@@ -307,21 +1022,137 @@ class DBHandler:
         if ecountry:
             filters += [{"page.displayed_country": {"$in": icountries}}]
         if sentiment:
-            timestamp_threshold = datetime.now() - timedelta(days=30)
-
             filters += [
                 {"page.is_positive": 1},
-                {"page.orig.timestamp": {"$gte": timestamp_threshold.isoformat()}}
+                {"page.orig.timestamp": {"$gte": DBHandler.get_positive_threshold()}}
             ]
-        filter_ = {"$and": filters}
-        sort_ = get_sort(itopics)
+        return {"$and": filters}
+
+    @staticmethod
+    def get_positive_threshold() -> str:
+        return (datetime.now() - timedelta(days=POSITIVE_DAYS)).isoformat()
+
+    @staticmethod
+    def get_article_sort(itopics: List[str] = None, sentiment: bool = False):
+        sort_ = [("page.orig.simple_timestamp", DESCENDING)]
         if sentiment:
-            sort_.insert(1, ("page.sentiment", DESCENDING))
-        cur = self.article_coll.find(filter=filter_, sort=sort_)
-        reshaped_articles = [
-            reshape_article(doc["page"]) for doc in cur.skip(start).limit(limit)
+            sort_ += [("page.sentiment", DESCENDING)]
+        if itopics:
+            sort_ += [(f"page.topics.{itopic}", DESCENDING) for itopic in itopics]
+        # NOTE: `_id` breaks ties so that the order is total, which cursors rely on.
+        return sort_ + [("_id", DESCENDING)]
+
+    @staticmethod
+    def get_tweet_sort():
+        return [
+            ("simpleTimestamp", DESCENDING),
+            ("retweetCount", DESCENDING),
+            ("timestamp", DESCENDING),
+            ("_id", DESCENDING),
         ]
-        return reshaped_articles
+
+    @staticmethod
+    def encode_cursor(key_values: List[Tuple[str, Any]]) -> str:
+        return base64.urlsafe_b64encode(json_util.dumps(key_values).encode("utf-8")).decode("ascii")
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> List[Tuple[str, Any]]:
+        """Decode a cursor into pairs of a sort key and its value. Raise InvalidCursor if it is malformed."""
+        try:
+            key_values = json_util.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        except (binascii.Error, UnicodeError, ValueError) as e:
+            raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+        if not isinstance(key_values, list) or not key_values:
+            raise InvalidCursor(f"Invalid cursor: {cursor}")
+        for key_value in key_values:
+            # NOTE: the values are compared in a query, so documents such as {"$ne": null} must not pass as operators.
+            if not (
+                isinstance(key_value, list)
+                and len(key_value) == 2
+                and isinstance(key_value[0], str)
+                and (key_value[1] is None or isinstance(key_value[1], (str, int, float, ObjectId)))
+            ):
+                raise InvalidCursor(f"Invalid cursor: {cursor}")
+        return [(key, value) for key, value in key_values]
+
+    def get_cursor(self, doc: dict, sort_: List[Tuple[str, int]]) -> str:
+        """Encode the sort key of a document so that the following documents can be fetched with a range predicate."""
+
+        def get_value(key: str):
+            value = doc
+            for key_ in key.split("."):
+                if not isinstance(value, dict) or key_ not in value:
+                    return None
+                value = value[key_]
+            return value
+
+        return self.encode_cursor([(key, get_value(key)) for key, _ in sort_])
+
+    @staticmethod
+    def get_keyset_filter(sort_: List[Tuple[str, int]], key_values: List[Tuple[str, Any]]) -> dict:
+        """Build a filter matching the documents after a sort key `key_values` in the descending order `sort_`.
+
+        Raise InvalidCursor if the cursor was issued for another sort order, such as that of another topic.
+        """
+        if [key for key, _ in key_values] != [key for key, _ in sort_]:
+            raise InvalidCursor("The cursor does not match the sort order.")
+        values = [value for _, value in key_values]
+        clauses = []
+        for i, ((key, _), value) in enumerate(zip(sort_, values)):
+            if value is None:
+                continue  # Nothing comes after a missing value in descending order.
+            equals = [{key_: value_} for (key_, _), value_ in zip(sort_[:i], values[:i])]
+            # NOTE: missing values come last in descending order.
+            clauses.append({"$and": equals + [{"$or": [{key: {"$lt": value}}, {key: None}]}]})
+        return {"$or": clauses}
+
+    @staticmethod
+    def trim_snippet(search_snippet: str):
+        if len(search_snippet) <= 70:
+            return search_snippet
+        else:
+            split = search_snippet.split("<em>")
+            prev_context, rest = split[0], "<em>".join(split[1:])
+            prev_context = prev_context.split("、")[-1]
+            return f"{prev_context}<em>{rest}"
+
+    @staticmethod
+    def get_article_projection(lang: str) -> Dict[str, int]:
+        """Exclude the fields for the other language, which `reshape_article` would drop anyway."""
+        other_lang = "en" if lang == "ja" else "ja"
+        return {
+            f"page.{other_lang}_snippets": 0,
+            f"page.{other_lang}_translated": 0,
+            f"page.{other_lang}_domain_label": 0,
+        }
+
+    @staticmethod
+    def reshape_article(doc: dict, lang: str, search_snippet=None) -> dict:
+        """Reshape an article projected by `get_article_projection(lang)`."""
+        snippets = doc.pop(f"{lang}_snippets")
+        doc["topics"] = [
+            {
+                "name": ETOPIC_TRANS_MAP[(ITOPIC_ETOPIC_MAP[itopic], lang)],
+                "snippet": snippets[itopic],
+                "relatedness": doc["topics"][itopic],
+            }
+            for itopic in doc["topics"]
+            if itopic in ITOPICS
+        ]
+        if search_snippet:
+            doc["topics"].append(
+                {
+                    "name": "Search",
+                    "snippet": search_snippet[0],
+                    "relatedness": -1.0,
+                }
+            )
+        doc["translated"] = doc.pop(f"{lang}_translated")
+        doc["domain_label"] = doc.pop(f"{lang}_domain_label")
+        doc["is_about_false_rumor"] = (
+            1 if doc["domain"] == "fij.info" else doc["is_about_false_rumor"]
+        )
+        return doc
 
     def get_positive_articles(self, etopic: str, ecountry: str, lang: str, query: str):
         if etopic is None:
@@ -329,10 +1160,42 @@ class DBHandler:
         if ecountry is None:
             ecountry = "all"
         etopic = ETOPIC_TRANS_MAP.get((etopic, "ja"), etopic)
-        return self.get_articles(etopic, ecountry, 0, 5, lang, "", sentiment=True)
+
+        # Use the materialized positive news, evicting the articles that have aged out since it was built.
+        # NOTE: articles are sorted by date, so the ones that remain are still the newest ones.
+        feed = next(
+            self.feed_coll.aggregate(
+                [
+                    {"$match": {"_id": self.get_feed_key(etopic, ecountry, lang, sentiment=True)}},
+                    {
+                        "$project": {
+                            "articles": {
+                                "$filter": {
+                                    "input": "$articles",
+                                    "as": "article",
+                                    "cond": {"$gte": ["$$article.orig.timestamp", self.get_positive_threshold()]},
+                                }
+                            },
+                            "is_complete": 1,
+                        }
+                    },
+                ]
+            ),
+            None,
+        )
+        if feed is not None and self.feed_covers(feed, POSITIVE_ARTICLE_LIMIT):
+            return feed["articles"][:POSITIVE_ARTICLE_LIMIT]
+        return self.get_articles(etopic, ecountry, 0, POSITIVE_ARTICLE_LIMIT, lang, "", sentiment=True)
 
     def get_tweets_sorted_by_topic(
-        self, etopic: str, ecountry: str, start: int, limit: int, lang: str, query: str
+        self,
+        etopic: str,
+        ecountry: str,
+        start: int,
+        limit: int,
+        lang: str,
+        query: str,
+        cursor: Optional[str] = None,
     ):
         etopic = ETOPIC_TRANS_MAP.get((etopic, "ja"), etopic)
         ecountry = ECOUNTRY_TRANS_MAP.get((ecountry, "ja"), ecountry)
@@ -342,33 +1205,49 @@ class DBHandler:
             ) or ecountry not in ECOUNTRY_ICOUNTRIES_MAP:
                 return []
             reshaped_tweets = self.get_tweets(
-                etopic, ecountry, start, limit, lang, query
+                etopic, ecountry, start, limit, lang, query, cursor=cursor
             )
         elif etopic:
-            reshaped_tweets = {}
-            for ecountry in filter(
+            ecountries = filter(
                 lambda ecountry_: ecountry_ != "all", ECOUNTRY_ICOUNTRIES_MAP.keys()
-            ):
-                if etopic != "search" and etopic not in ETOPIC_ITOPICS_MAP:
-                    reshaped_tweets[ecountry] = []
-                else:
-                    reshaped_tweets[ecountry] = self.get_tweets(
-                        etopic, ecountry, start, limit, lang, query
-                    )
+            )
+            if etopic != "search" and etopic not in ETOPIC_ITOPICS_MAP:
+                reshaped_tweets = {ecountry: [] for ecountry in ecountries}
+            elif etopic == "search":
+                reshaped_tweets = self.search_tweets(list(ecountries), start, limit, lang, query)
+            else:
+                reshaped_tweets = self.fan_out(
+                    {
+                        ecountry: partial(
+                            self.get_tweets, etopic, ecountry, start, limit, lang, query
+                        )
+                        for ecountry in ecountries
+                    }
+                )
         else:
             reshaped_tweets = {}
             for etopic in ["all"]:
-                reshaped_tweets[etopic] = {}
-                for ecountry in filter(
-                    lambda ecountry_: ecountry_ != "all", ECOUNTRY_ICOUNTRIES_MAP.keys()
-                ):
-                    reshaped_tweets[etopic][ecountry] = self.get_tweets(
-                        etopic, ecountry, start, limit, lang, query
-                    )
+                reshaped_tweets[etopic] = self.fan_out(
+                    {
+                        ecountry: partial(
+                            self.get_tweets, etopic, ecountry, start, limit, lang, query
+                        )
+                        for ecountry in filter(
+                            lambda ecountry_: ecountry_ != "all", ECOUNTRY_ICOUNTRIES_MAP.keys()
+                        )
+                    }
+                )
         return reshaped_tweets
 
     def get_tweets_sorted_by_country(
-        self, ecountry: str, etopic: str, start: int, limit: int, lang: str, query: str
+        self,
+        ecountry: str,
+        etopic: str,
+        start: int,
+        limit: int,
+        lang: str,
+        query: str,
+        cursor: Optional[str] = None,
     ):
         ecountry = ECOUNTRY_TRANS_MAP.get((ecountry, "ja"), ecountry)
         etopic = ETOPIC_TRANS_MAP.get((etopic, "ja"), etopic)
@@ -378,7 +1257,7 @@ class DBHandler:
             ) or ecountry not in ECOUNTRY_ICOUNTRIES_MAP:
                 return []
             reshaped_tweets = self.get_tweets(
-                etopic, ecountry, start, limit, lang, query
+                etopic, ecountry, start, limit, lang, query, cursor=cursor
             )
         elif ecountry:
             reshaped_tweets = {}
@@ -387,61 +1266,42 @@ class DBHandler:
                     etopic, ecountry, start, limit, lang, query
                 )
         else:
-            reshaped_tweets = {}
-            for ecountry in filter(
-                lambda ecountry_: ecountry_ != "all", ECOUNTRY_ICOUNTRIES_MAP.keys()
-            ):
-                reshaped_tweets[ecountry] = {}
-                for etopic in ["all"]:
-                    reshaped_tweets[ecountry][etopic] = self.get_tweets(
-                        etopic, ecountry, start, limit, lang, query
+            cells = self.fan_out(
+                {
+                    (ecountry, etopic): partial(
+                        self.get_tweets, etopic, ecountry, start, limit, lang, query
+                    )
+                    for ecountry in filter(
+                        lambda ecountry_: ecountry_ != "all", ECOUNTRY_ICOUNTRIES_MAP.keys()
                     )
+                    for etopic in ["all"]
+                }
+            )
+            reshaped_tweets = {}
+            for (ecountry, etopic), tweets in cells.items():
+                reshaped_tweets.setdefault(ecountry, {})[etopic] = tweets
         return reshaped_tweets
 
     def get_tweets(
-        self, etopic: str, ecountry: str, start: int, limit: int, lang: str, query: str
+        self,
+        etopic: str,
+        ecountry: str,
+        start: int,
+        limit: int,
+        lang: str,
+        query: str,
+        cursor: Optional[str] = None,
     ) -> List[dict]:
         # Use ElasticSearch to search for articles.
         if etopic and etopic == "search":
-            icountries = ECOUNTRY_ICOUNTRIES_MAP.get(ecountry, [])
             r = self.es.search(
-                index="covid19-tweets-ja" if lang == "ja" else "covid19-tweets-en",
-                body={
-                    "query": {
-                        "bool": {
-                            "must": [
-                                {
-                                    "bool": {
-                                        "should": [
-                                            {"term": {"country": icountry}}
-                                            for icountry in icountries
-                                        ]
-                                    }
-                                },
-                                {"match": {"text": query}},
-                            ]
-                        }
-                    },
-                    "sort": [
-                        {
-                            "timestamp.local": {
-                                "order": "desc",
-                                "nested": {"path": "timestamp"},
-                            }
-                        }
-                    ],
-                    "from": start,
-                    "size": limit,
-                },
+                index=self.get_tweet_search_index(lang),
+                body=self.get_tweet_search_body(ecountry, start, limit, query),
             )
             hits = r["hits"]["hits"]
             if len(hits) == 0:
                 return []
-            cur = self.tweet_coll.find(
-                filter={"_id": {"$in": [hit["_id"] for hit in hits]}},
-                sort=[("simpleTimestamp", DESCENDING)],
-            )
-            return [Tweet(**doc).as_api_ret(lang) for doc in cur]
+            return self.get_tweets_from_hits({ecountry: hits}, lang)[ecountry]
 
         # Use MongoDB to search for articles.
         if etopic != "all":
@@ -450,13 +1310,15 @@ class DBHandler:
             )  # This is because tweets are not categorized by topics at the moment.
         icountries = ECOUNTRY_ICOUNTRIES_MAP.get(ecountry, [])
         filter_ = {"country": {"$in": icountries}}
-        sort_ = [
-            ("simpleTimestamp", DESCENDING),
-            ("retweetCount", DESCENDING),
-            ("timestamp", DESCENDING),
-        ]
+        sort_ = self.get_tweet_sort()
+        if cursor:
+            filter_ = {"$and": [filter_, self.get_keyset_filter(sort_, self.decode_cursor(cursor))]}
+            start = 0
         cur = self.tweet_coll.find(filter=filter_, sort=sort_)
-        return [Tweet(**doc).as_api_ret(lang) for doc in cur.skip(start).limit(limit)]
+        return [
+            {**Tweet(**doc).as_api_ret(lang), "cursor": self.get_cursor(doc, sort_)}
+            for doc in cur.skip(start).limit(limit)
+        ]
 
     def update_page(
         self,
@@ -493,6 +1355,13 @@ class DBHandler:
             },
             upsert=True,
         )
+        try:
+            self.update_feeds_of_page(url, icountry, etopics)
+        except Exception:
+            # NOTE: the edit is already stored. `update_feeds` rebuilds the feeds that could not be patched.
+            logger.exception(f"Failed to patch the feeds of {url}.")
+        if self.cache_handler:
+            self.cache_handler.bump_version()
         return {
             "url": url,
             "is_hidden": new_is_hidden,
@@ -0,0 +1,106 @@
+import collections
+import hashlib
+import logging
+import sqlite3
+from typing import Optional
+
+from langdetect import DetectorFactory, detect
+
+from sqlite_handler import SQLiteHandler
+
+logger = logging.getLogger(__file__)
+
+# NOTE: make langdetect deterministic.
+DetectorFactory.seed = 0
+
+# The share of kana among letters above which a text is Japanese. Kana is not used by any other language.
+KANA_RATIO_THRESHOLD = 0.1
+# The share of ASCII letters among letters above which a text written with English function words is English.
+ASCII_RATIO_THRESHOLD = 0.95
+# NOTE: only words that are not common in other languages written in Latin letters. "a", "in", "to" or "as" are
+# also Spanish, Italian or German, "was" and "will" are German, and "is" and "of" are Dutch.
+ENGLISH_FUNCTION_WORDS = {
+    "the", "and", "with", "are", "were", "has", "have", "from", "after", "its", "how", "what", "why", "which",
+    "their", "this", "that",
+}
+
+
+def is_kana(char: str) -> bool:
+    # Hiragana, katakana and half-width katakana.
+    return "\u3040" <= char <= "\u30ff" or "\uff66" <= char <= "\uff9f"
+
+
+def is_kanji(char: str) -> bool:
+    # CJK unified ideographs and their extension A.
+    return "\u4e00" <= char <= "\u9fff" or "\u3400" <= char <= "\u4dbf"
+
+
+class LanguageChecker:
+    """Check if titles are written in a language.
+
+    Most titles are decided from the classes of their characters. Only ambiguous ones are passed to langdetect,
+    whose results are memoized in an SQLite file by the hash of the title. `counts` records how many titles were
+    decided by each path: "script", "cache" or "langdetect".
+    """
+
+    def __init__(self, cache_path: Optional[str] = None):
+        self.cache_path = cache_path
+        self.sqlite_handler = None
+        if cache_path:
+            self.sqlite_handler = SQLiteHandler(
+                cache_path, statements=["CREATE TABLE IF NOT EXISTS langs (hash TEXT PRIMARY KEY, lang TEXT)"]
+            )
+        self.counts = collections.Counter()
+
+    def connect(self) -> Optional[sqlite3.Connection]:
+        if self.sqlite_handler is None:
+            return None
+        return self.sqlite_handler.connect()
+
+    def is_lang(self, text: str, lang: str) -> bool:
+        """Return True if `text` is written in `lang`. Raise langdetect's exception if it cannot be decided."""
+        decision = self.check_script(text, lang)
+        if decision is not None:
+            self.counts["script"] += 1
+            return decision
+
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        conn = self.connect()
+        if conn is not None:
+            row = conn.execute("SELECT lang FROM langs WHERE hash = ?", (key,)).fetchone()
+            if row is not None:
+                self.counts["cache"] += 1
+                return row[0] == lang
+
+        detected = detect(text)
+        self.counts["langdetect"] += 1
+        if conn is not None:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO langs VALUES (?, ?)", (key, detected))
+        return detected == lang
+
+    @staticmethod
+    def check_script(text: str, lang: str) -> Optional[bool]:
+        """Decide the language from the classes of characters. Return None if it is ambiguous."""
+        letters = [char for char in text if char.isalpha()]
+        if not letters:
+            return None
+        num_kana = sum(1 for char in letters if is_kana(char))
+        num_kanji = sum(1 for char in letters if is_kanji(char))
+        num_ascii = sum(1 for char in letters if char.isascii())
+        if lang == "ja":
+            if num_kana / len(letters) >= KANA_RATIO_THRESHOLD:
+                return True
+            if num_kana + num_kanji == 0:
+                return False
+            return None  # Kanji without kana may be Chinese.
+        if lang == "en":
+            if num_ascii / len(letters) >= ASCII_RATIO_THRESHOLD:
+                words = {word.strip(".,:;!?\"'()[]").lower() for word in text.split()}
+                if words & ENGLISH_FUNCTION_WORDS:
+                    return True
+                return None  # Other languages are written in ASCII letters, too.
+            if num_ascii / len(letters) < 1 - ASCII_RATIO_THRESHOLD:
+                return False
+            return None
+        return None
@@ -1,50 +1,302 @@
+import fcntl
+import glob
 import json
+import logging
 import os
-from typing import List
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlite_handler import SQLiteHandler
+
+logger = logging.getLogger(__file__)
 
 TOPIC_CHECK_LOG = "category_check.txt"
+TOPIC_CHECK_INDEX = "category_check.index.sqlite3"
 FEEDBACK_LOG = "feedback.txt"
 PAGE_NUMBER_LOG = "update.txt"
 TWEET_NUMBER_LOG = "tweet.txt"
 
+MAX_SQL_VARIABLES = 999  # the default limit of SQLite
+
+
+def get_log_paths(path: str) -> List[str]:
+    """Return the rotated segments of a log from the oldest, followed by the log itself if it exists."""
+    # NOTE: check the log before listing the segments, so that a segment rotated in between is not missed.
+    exists = os.path.exists(path)
+    segments = sorted(
+        (segment for segment in glob.glob(f"{glob.escape(path)}.*") if segment.rsplit(".", 1)[1].isdecimal()),
+        key=lambda segment: int(segment.rsplit(".", 1)[1]),
+    )
+    return segments + ([path] if exists else [])
+
+
+def stat_log_paths(path: str) -> List[Tuple[str, os.stat_result]]:
+    """Return the paths of a log as `get_log_paths` does, each with its stat."""
+    while True:
+        try:
+            return [(log_path, os.stat(log_path)) for log_path in get_log_paths(path)]
+        except FileNotFoundError:
+            continue  # NOTE: the log has been rotated in between.
+
+
+class LogWriter:
+    """Append lines to a log file shared with other processes.
+
+    Lines written concurrently by the threads of a process are committed together: while one thread writes and
+    fsyncs a batch, the lines of the others are queued and committed by the next one, so a writer waits for at
+    most two commits. A commit holds an exclusive lock of the file, so lines of different processes never
+    interleave. When the file gets larger than `max_bytes`, it is renamed to the next segment "<path>.<number>".
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.condition = threading.Condition()
+        self.pending: List[bytes] = []
+        self.num_queued = 0
+        self.num_committed = 0
+        self.committing = False
+
+    def write(self, lines: List[str]):
+        """Append lines and return once they are written to the disk."""
+        data = "".join(f"{line}\n" for line in lines).encode("utf-8")
+        with self.condition:
+            self.pending.append(data)
+            self.num_queued += 1
+            seq = self.num_queued
+            while self.num_committed < seq:
+                if self.committing:
+                    self.condition.wait()
+                    continue
+                # Commit everything queued so far on behalf of the other threads.
+                batch, self.pending = self.pending, []
+                batch_seq = self.num_queued
+                self.committing = True
+                self.condition.release()
+                try:
+                    self.commit(b"".join(batch))
+                except BaseException:
+                    self.condition.acquire()
+                    self.pending = batch + self.pending  # NOTE: the next writer retries them.
+                    self.committing = False
+                    self.condition.notify_all()
+                    raise
+                self.condition.acquire()
+                self.num_committed = batch_seq
+                self.committing = False
+                self.condition.notify_all()
+
+    def commit(self, data: bytes):
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    is_current = os.fstat(fd).st_ino == os.stat(self.path).st_ino
+                except FileNotFoundError:
+                    is_current = False
+                if not is_current:
+                    continue  # NOTE: another process rotated the file before we locked it.
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                os.fsync(fd)
+                if self.max_bytes and os.fstat(fd).st_size >= self.max_bytes:
+                    self.rotate()
+                return
+            finally:
+                os.close(fd)
+
+    def rotate(self):
+        segments = get_log_paths(self.path)[:-1]
+        number = int(segments[-1].rsplit(".", 1)[1]) + 1 if segments else 1
+        os.rename(self.path, f"{self.path}.{number:06d}")
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class TopicCheckIndex:
+    """An index from URLs to the locations of their latest entries in the topic check log.
+
+    A location is the inode of a segment of the log and an offset in it, so rotating the log does not move it.
+    The index remembers the part of the log it covers, and the lines appended after it are indexed on demand.
+    It is rebuilt when it is missing or when the log has been truncated or replaced.
+    """
+
+    def __init__(self, path: str, log_path: str):
+        self.path = path
+        self.log_path = log_path
+        self.sqlite_handler = SQLiteHandler(
+            path,
+            isolation_level=None,
+            statements=[
+                "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)",
+                "CREATE TABLE IF NOT EXISTS locations (url TEXT PRIMARY KEY, inode INTEGER, offset INTEGER)",
+            ],
+        )
+
+    def connect(self) -> sqlite3.Connection:
+        return self.sqlite_handler.connect()
+
+    def update(self) -> int:
+        """Index the lines appended to the log since the last update and return the number of URLs in them."""
+        conn = self.connect()
+        stats = stat_log_paths(self.log_path)
+        if not stats:
+            return 0
+        meta = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+        if meta.get("inode") == stats[-1][1].st_ino and meta.get("size") == stats[-1][1].st_size:
+            return 0  # NOTE: the common case, which needs no lock.
+        # NOTE: take the write lock first so that only one process indexes the same lines.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            while True:
+                num_urls = self._index(conn, stat_log_paths(self.log_path))
+                if num_urls is not None:
+                    break
+            conn.execute("COMMIT")
+            return num_urls
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _index(self, conn: sqlite3.Connection, stats: List[Tuple[str, os.stat_result]]) -> Optional[int]:
+        """Index the segments in `stats`. Return None if the log has been rotated after they were taken."""
+        if not stats:
+            return 0
+        meta = dict(conn.execute("SELECT name, value FROM meta").fetchall())
+        # Resume from the segment indexed last, which may have been rotated since then.
+        start, offset = 0, 0
+        for i, (_, stat) in enumerate(stats):
+            if stat.st_ino == meta.get("inode") and stat.st_size >= meta.get("size", 0):
+                start, offset = i, meta["size"]
+                break
+        else:
+            if meta:
+                logger.warning("The topic check log has been truncated or replaced. Rebuild the index.")
+            conn.execute("DELETE FROM locations")
+        url_to_location = {}
+        last_inode, last_offset = None, 0
+        for path, stat in stats[start:]:
+            try:
+                f = open(path, mode="rb")
+            except FileNotFoundError:
+                return None
+            with f:
+                if os.fstat(f.fileno()).st_ino != stat.st_ino:
+                    return None
+                f.seek(offset)
+                for raw_line in f:
+                    if not raw_line.endswith(b"\n"):
+                        break  # NOTE: the last line may be being written.
+                    if raw_line.strip():
+                        try:
+                            url_to_location[json.loads(raw_line)["url"]] = (stat.st_ino, offset)
+                        except (ValueError, KeyError, TypeError):
+                            logger.warning(f"Skip a malformed line at {offset} of {path}.")
+                    offset += len(raw_line)
+            last_inode, last_offset = stat.st_ino, offset
+            offset = 0
+        conn.executemany(
+            "INSERT OR REPLACE INTO locations VALUES (?, ?, ?)",
+            [(url, inode, offset) for url, (inode, offset) in url_to_location.items()],
+        )
+        conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [("inode", last_inode), ("size", last_offset)])
+        return len(url_to_location)
+
+    def clear(self):
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM meta")
+        conn.execute("DELETE FROM locations")
+        conn.execute("COMMIT")
+
+    def get_many(self, urls: List[str]) -> Dict[str, Tuple[int, int]]:
+        conn = self.connect()
+        url_to_location = {}
+        urls = list(set(urls))
+        for i in range(0, len(urls), MAX_SQL_VARIABLES):
+            chunk = urls[i:i + MAX_SQL_VARIABLES]
+            for url, inode, offset in conn.execute(
+                f"SELECT url, inode, offset FROM locations WHERE url IN ({', '.join('?' * len(chunk))})", chunk
+            ):
+                url_to_location[url] = (inode, offset)
+        return url_to_location
+
 
 class LogHandler:
-    def __init__(self, log_dir: str):
+    def __init__(self, log_dir: str, max_bytes: int = 0):
         self.log_dir = log_dir
+        self.writers = {
+            name: LogWriter(os.path.join(self.log_dir, name), max_bytes)
+            for name in (TOPIC_CHECK_LOG, FEEDBACK_LOG, PAGE_NUMBER_LOG, TWEET_NUMBER_LOG)
+        }
+        self.topic_check_index = TopicCheckIndex(
+            os.path.join(self.log_dir, TOPIC_CHECK_INDEX), os.path.join(self.log_dir, TOPIC_CHECK_LOG)
+        )
 
     def extend_topic_check_log(self, lines: List[str]):
-        self.extend_log(os.path.join(self.log_dir, TOPIC_CHECK_LOG), lines)
+        self.writers[TOPIC_CHECK_LOG].write(lines)
 
     def extend_feedback_log(self, lines: List[str]):
-        self.extend_log(os.path.join(self.log_dir, FEEDBACK_LOG), lines)
+        self.writers[FEEDBACK_LOG].write(lines)
 
     def extend_page_number_log(self, lines: List[str]):
-        self.extend_log(os.path.join(self.log_dir, PAGE_NUMBER_LOG), lines)
+        self.writers[PAGE_NUMBER_LOG].write(lines)
 
     def extend_tweet_number_log(self, lines: List[str]):
-        self.extend_log(os.path.join(self.log_dir, TWEET_NUMBER_LOG), lines)
+        self.writers[TWEET_NUMBER_LOG].write(lines)
 
-    @staticmethod
-    def extend_log(path: str, lines: List[str]):
-        with open(path, "a") as f:
-            for line in lines:
-                f.write(line + "\n")
+    def get_topic_check_log_paths(self) -> List[str]:
+        """Return the rotated segments of the topic check log from the oldest, followed by the log itself."""
+        return get_log_paths(os.path.join(self.log_dir, TOPIC_CHECK_LOG))
+
+    def update_topic_check_index(self) -> int:
+        return self.topic_check_index.update()
 
     def find_topic_check_log(self, url: str):
-        path = os.path.join(self.log_dir, TOPIC_CHECK_LOG)
-        with open(path) as f:
-            for line in reversed(f.readlines()):
-                if line.strip() == "":
-                    break
-                edited_info = json.loads(line)
-                if edited_info.get("url", "") == url:
-                    edited_info["is_checked"] = 1
-                    return edited_info
-        return {"url": url, "is_checked": 0}
+        return self.find_topic_check_logs([url])[0]
+
+    def find_topic_check_logs(self, urls: List[str], retry: bool = True) -> List[dict]:
+        """Return the latest entry of each URL in the topic check log, in the order of `urls`."""
+        self.update_topic_check_index()
+        url_to_location = self.topic_check_index.get_many(urls)
+        inode_to_path = {
+            stat.st_ino: path for path, stat in stat_log_paths(os.path.join(self.log_dir, TOPIC_CHECK_LOG))
+        }
+        inode_to_entries = {}
+        for url, (inode, offset) in url_to_location.items():
+            inode_to_entries.setdefault(inode, []).append((offset, url))
+        url_to_edited_info = {}
+        for inode, entries in inode_to_entries.items():
+            edited_infos = []
+            if inode in inode_to_path:
+                with open(inode_to_path[inode], mode="rb") as f:
+                    # NOTE: read the entries in the order of their offsets.
+                    for offset, url in sorted(entries):
+                        f.seek(offset)
+                        try:
+                            edited_infos.append((url, json.loads(f.readline())))
+                        except ValueError:
+                            edited_infos.append((url, {}))
+            if len(edited_infos) < len(entries) or any(info.get("url", "") != url for url, info in edited_infos):
+                if retry:
+                    logger.warning(f"The index of {TOPIC_CHECK_LOG} does not match the log. Rebuild it.")
+                    self.topic_check_index.clear()
+                    return self.find_topic_check_logs(urls, retry=False)
+                continue
+            for url, edited_info in edited_infos:
+                edited_info["is_checked"] = 1
+                url_to_edited_info[url] = edited_info
+        return [url_to_edited_info.get(url, {"url": url, "is_checked": 0}) for url in urls]
 
     def iterate_topic_check_log(self):
-        path = os.path.join(self.log_dir, TOPIC_CHECK_LOG)
-        with open(path) as f:
-            for line in f:
-                if line.strip():
-                    yield line
+        for path in self.get_topic_check_log_paths():
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        yield line
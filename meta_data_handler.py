@@ -1,6 +1,8 @@
 import json
 import os
-from typing import List
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
 
 from util import COUNTRIES, TOPICS
 
@@ -10,6 +12,37 @@ class MetaDataHandler:
         self.meta_data_dir = os.path.join(os.path.dirname(__file__), "data")
         self.stats_path = os.path.join(self.meta_data_dir, "stats.json")
         self.sources_path = os.path.join(self.meta_data_dir, "sources.json")
+        # The serialized payload of each language, with the signature of the files it was built from.
+        self.lang_to_payload: Dict[str, Tuple[tuple, bytes]] = {}
+        self.lock = threading.Lock()
+
+    def get_signature(self) -> tuple:
+        """Return what identifies the current versions of the files. They are rewritten by another process."""
+        signature = ()
+        for path in (self.stats_path, self.sources_path):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                signature += (None,)
+                continue
+            signature += ((stat.st_ino, stat.st_mtime_ns, stat.st_size),)
+        return signature
+
+    def get_json(self, lang: str) -> bytes:
+        """Return the payload of `get` serialized in JSON. It is rebuilt only when the files have changed."""
+        signature = self.get_signature()
+        cached: Optional[Tuple[tuple, bytes]] = self.lang_to_payload.get(lang)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        with self.lock:
+            payload = json.dumps(self.get(lang), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            # NOTE: the signature is taken before reading the files, so a file replaced meanwhile is read again.
+            self.lang_to_payload[lang] = (signature, payload)
+        return payload
+
+    def invalidate(self):
+        with self.lock:
+            self.lang_to_payload.clear()
 
     def get(self, lang: str):
         topics = self.get_topics(lang)
@@ -60,11 +93,25 @@ class MetaDataHandler:
             return json.load(f)
 
     def set_stats(self, stats):
-        os.makedirs(os.path.dirname(self.stats_path), exist_ok=True)
-        with open(self.stats_path, "w") as f:
-            json.dump(stats, f, ensure_ascii=False)
+        self.dump(self.stats_path, stats)
+        self.invalidate()
 
     def set_sources(self, sources):
-        os.makedirs(os.path.dirname(self.sources_path), exist_ok=True)
-        with open(self.sources_path, "w") as f:
-            json.dump(sources, f, ensure_ascii=False)
+        self.dump(self.sources_path, sources)
+        self.invalidate()
+
+    @staticmethod
+    def dump(path: str, data):
+        # NOTE: replace the file at once so that readers never see it half written.
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            os.fchmod(fd, 0o644)  # NOTE: mkstemp creates a file only its owner can read.
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
@@ -1,17 +1,227 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from sqlite_handler import SQLiteHandler
+
+logger = logging.getLogger(__file__)
+
+# NOTE: Slack truncates messages longer than 40000 characters.
+MAX_MESSAGE_LENGTH = 40000
+MESSAGE_SEPARATOR = "\n\n---\n\n"
+
+
+class SlackError(Exception):
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 
 class SlackHandler:
-    def __init__(self, access_token: str, app_channel: str) -> None:
+    def __init__(self, access_token: str, app_channel: str, timeout: float = 10.0) -> None:
         self.access_token = access_token
         self.app_channel = app_channel
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get_session(self) -> requests.Session:
+        # NOTE: pooled connections must not be shared across forked gunicorn workers.
+        session = getattr(self.local, "session", None)
+        if session is None or self.local.pid != os.getpid():
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self.local.session = session
+            self.local.pid = os.getpid()
+        return session
 
     def post(self, text: str) -> None:
-        requests.post(
-            "https://slack.com/api/chat.postMessage",
-            data={
-                "token": self.access_token,
-                "channel": self.app_channel,
-                "text": text,
-            },
+        """Post a message to the channel. Raise SlackError if Slack does not accept it."""
+        try:
+            response = self.get_session().post(
+                "https://slack.com/api/chat.postMessage",
+                data={
+                    "token": self.access_token,
+                    "channel": self.app_channel,
+                    "text": text,
+                },
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            raise SlackError(f"Failed to post to {self.app_channel}: {e}")
+        if response.status_code == 429:
+            raise SlackError("Rate limited by Slack.", retry_after=float(response.headers.get("Retry-After", 1)))
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if response.status_code != 200 or not body.get("ok", False):
+            raise SlackError(f"Failed to post to {self.app_channel}: {response.status_code} {body.get('error', '')}")
+
+
+class SlackQueue:
+    """A durable queue of messages to post to Slack, delivered by a background thread.
+
+    Messages are stored in an SQLite file, one row per channel, before `put` returns. Every process that calls
+    `start` runs a thread that claims due messages for `lease` seconds, posts the messages of each channel
+    together, and deletes them once Slack accepts them. A failed post is retried after an exponential backoff,
+    and a message claimed by a process that died is delivered by another once its lease expires.
+    """
+
+    def __init__(
+        self,
+        slack_handlers: List[SlackHandler],
+        path: str,
+        batch_size: int = 20,
+        batch_window: float = 1.0,
+        poll_interval: float = 10.0,
+        lease: float = 60.0,
+        max_attempts: int = 10,
+        max_backoff: float = 600.0,
+    ):
+        if not path:
+            # NOTE: SQLite opens a private temporary database for an empty path, which no other thread would see.
+            raise ValueError("The path of the Slack queue is empty.")
+        self.channel_to_handler = {handler.app_channel: handler for handler in slack_handlers}
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.sqlite_handler = SQLiteHandler(
+            path,
+            isolation_level=None,
+            statements=[
+                "CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT, text TEXT, "
+                "attempts INTEGER DEFAULT 0, next_attempt_at REAL DEFAULT 0, claimed_until REAL DEFAULT 0)",
+                "CREATE INDEX IF NOT EXISTS messages_next_attempt_at ON messages (next_attempt_at)",
+            ],
         )
+        self.wake_up = threading.Event()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.pid: Optional[int] = None
+
+    def connect(self) -> sqlite3.Connection:
+        return self.sqlite_handler.connect()
+
+    def put(self, text: str) -> None:
+        """Queue a message for every channel and return once it is stored."""
+        if not self.channel_to_handler:
+            return
+        conn = self.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO messages (channel, text) VALUES (?, ?)",
+                [(channel, text) for channel in self.channel_to_handler],
+            )
+        self.start()
+        self.wake_up.set()
+
+    def start(self) -> None:
+        """Start the delivery thread of this process unless it is running."""
+        if not self.channel_to_handler:
+            return
+        with self.lock:
+            # NOTE: a forked gunicorn worker does not inherit the thread of its parent.
+            if self.pid == os.getpid() and self.thread is not None and self.thread.is_alive():
+                return
+            self.wake_up = threading.Event()
+            self.thread = threading.Thread(target=self.run, name="slack-queue", daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            try:
+                row = self.connect().execute("SELECT MIN(MAX(next_attempt_at, claimed_until)) FROM messages").fetchone()
+                timeout = self.poll_interval if row[0] is None else row[0] - time.time()
+                woken = self.wake_up.wait(min(max(timeout, 0), self.poll_interval))
+                if woken:
+                    time.sleep(self.batch_window)  # NOTE: wait for the rest of a burst to post them together.
+                self.wake_up.clear()
+                while self.deliver() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Failed to deliver messages to Slack.")
+                time.sleep(self.poll_interval)
+
+    def claim(self) -> List[tuple]:
+        now = time.time()
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, channel, text, attempts FROM messages WHERE next_attempt_at <= ? AND claimed_until <= ? "
+                "ORDER BY id LIMIT ?",
+                (now, now, self.batch_size),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE messages SET claimed_until = ? WHERE id = ?", [(now + self.lease, row[0]) for row in rows]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def deliver(self) -> int:
+        """Post the due messages and return the number of messages claimed."""
+        rows = self.claim()
+        channel_to_rows = {}
+        for row in rows:
+            channel_to_rows.setdefault(row[1], []).append(row)
+        conn = self.connect()
+        for channel, channel_rows in channel_to_rows.items():
+            handler = self.channel_to_handler.get(channel)
+            if handler is None:
+                logger.warning(f"Drop {len(channel_rows)} messages to {channel}, which is no longer configured.")
+                conn.executemany("DELETE FROM messages WHERE id = ?", [(row[0],) for row in channel_rows])
+                continue
+            for batch in self.split(channel_rows):
+                try:
+                    handler.post(MESSAGE_SEPARATOR.join(row[2] for row in batch))
+                except SlackError as e:
+                    self.retry(batch, e)
+                    continue
+                conn.executemany("DELETE FROM messages WHERE id = ?", [(row[0],) for row in batch])
+        return len(rows)
+
+    @staticmethod
+    def split(rows: List[tuple]) -> List[List[tuple]]:
+        batches, batch, length = [], [], 0
+        for row in rows:
+            if batch and length + len(MESSAGE_SEPARATOR) + len(row[2]) > MAX_MESSAGE_LENGTH:
+                batches.append(batch)
+                batch, length = [], 0
+            length += len(row[2]) + (len(MESSAGE_SEPARATOR) if batch else 0)
+            batch.append(row)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def retry(self, rows: List[tuple], error: SlackError) -> None:
+        conn = self.connect()
+        now = time.time()
+        for id_, channel, _, attempts in rows:
+            if attempts + 1 >= self.max_attempts:
+                logger.error(f"Give up posting message {id_} to {channel} after {attempts + 1} attempts: {error}")
+                conn.execute("DELETE FROM messages WHERE id = ?", (id_,))
+                continue
+            delay = max(min(2 ** attempts, self.max_backoff), error.retry_after)
+            logger.warning(f"Retry posting message {id_} to {channel} in {delay:.0f} seconds: {error}")
+            conn.execute(
+                "UPDATE messages SET attempts = ?, next_attempt_at = ?, claimed_until = 0 WHERE id = ?",
+                (attempts + 1, now + delay, id_),
+            )
+
+    def count(self) -> int:
+        return self.connect().execute("SELECT COUNT(*) FROM messages").fetchone()[0]
@@ -0,0 +1,33 @@
+import os
+import sqlite3
+import threading
+from typing import List, Optional
+
+
+class SQLiteHandler:
+    """Open an SQLite file in WAL mode with one connection per thread and process.
+
+    `statements` are executed on every new connection, e.g. to set pragmas and to create tables.
+    """
+
+    def __init__(
+        self, path: str, timeout: float = 10.0, isolation_level: Optional[str] = "", statements: List[str] = ()
+    ):
+        self.path = path
+        self.timeout = timeout
+        self.isolation_level = isolation_level
+        self.statements = list(statements)
+        self.local = threading.local()
+
+    def connect(self) -> sqlite3.Connection:
+        # NOTE: connections must not be shared across threads nor across forked gunicorn workers.
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=self.isolation_level)
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.statements:
+                conn.execute(statement)
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn